@@ -0,0 +1,381 @@
+import itertools
+import threading
+import time
+
+import serial
+
+import protocol
+
+# three ways to talk to the board, ARDUINO_PROTOCOL in main.py picks one and
+# each needs its own sketch on the arduino:
+#   "legacy"  LegacyLink, the sketch that's deployed now. bare "DISPENSE HAPPY"
+#             lines, the board never answers
+#   "text"    ArduinoLink, sequenced lines with replies. needs a sketch that
+#             speaks the protocol below
+#   "framed"  FramedLink, binary frames from protocol.py. needs a sketch that
+#             speaks that
+#
+# text protocol, one message per line:
+#   host -> arduino:  "<seq> <COMMAND ...>"          e.g. "7 DISPENSE HAPPY"
+#   arduino -> host:  "ACK <seq>"                     command accepted
+#                     "PROGRESS <seq> <text>"         anything worth showing on screen
+#                     "DONE <seq>"                    command finished
+#                     "ERR <seq> <text>"              command failed
+# anything else (debug prints etc) is passed to on_unmatched
+
+
+class DeviceError(Exception):
+    pass
+
+
+class Command:
+    def __init__(self, seq, text, on_event=None):
+        self.seq = seq
+        self.text = text
+        self.on_event = on_event
+        self.sent_at = time.monotonic()
+        self.acked_at = None
+        self.done_at = None
+        self.error = None
+        self.frame = None       # encoded bytes, kept for resends (FramedLink)
+        self.resends = 0
+        self.acked = threading.Event()
+        self.done = threading.Event()
+
+    def _handle(self, kind, payload):
+        if kind == "ACK":
+            self.acked_at = time.monotonic()
+        elif kind == "DONE":
+            self.done_at = time.monotonic()
+        elif kind == "ERR":
+            self.error = payload or "device error"
+
+        # callback first so anyone waiting sees the last event already handled
+        if self.on_event:
+            self.on_event(kind, payload)
+
+        # PROGRESS means it was accepted too, in case the ACK itself got lost
+        if kind in ("ACK", "PROGRESS", "DONE", "ERR"):
+            self.acked.set()
+        if kind in ("DONE", "ERR"):
+            self.done.set()
+
+    def wait_ack(self, timeout):
+        if not self.acked.wait(timeout):
+            raise TimeoutError(f"No ACK for '{self.text}' after {timeout:.1f}s")
+        if self.error:
+            raise DeviceError(self.error)
+
+    def wait_done(self, timeout):
+        if not self.done.wait(timeout):
+            raise TimeoutError(f"'{self.text}' not done after {timeout:.1f}s")
+        if self.error:
+            raise DeviceError(self.error)
+
+    @property
+    def round_trip(self):
+        # seconds from send to DONE
+        if self.done_at is None:
+            return None
+        return self.done_at - self.sent_at
+
+
+class ArduinoLink:
+    # serial transport with a background reader that matches replies to commands
+    # port can be a device path, a pty path, or any pyserial url like loop://
+
+    def __init__(self, port, baud=115200, settle=2.0, on_unmatched=None):
+        self.port = port
+        self.baud = baud
+        self.settle = settle        # arduino resets when the port opens
+        self.on_unmatched = on_unmatched
+        self.serial = None
+        self._seq = itertools.count(1)
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._running = False
+        self._reader = None
+
+    @property
+    def connected(self):
+        return self.serial is not None and self._running
+
+    def open(self):
+        self.serial = serial.serial_for_url(self.port, self.baud, timeout=0.1)
+        if self.settle:
+            time.sleep(self.settle)
+        self.serial.reset_input_buffer()
+
+        self._running = True
+        self._reader = threading.Thread(target=self._read_loop, name="arduino-reader", daemon=True)
+        self._reader.start()
+        return self
+
+    def close(self):
+        self._running = False
+        if self._reader and self._reader is not threading.current_thread():
+            self._reader.join(1)
+        if self.serial:
+            self.serial.close()
+            self.serial = None
+        self._fail_all("link closed")
+
+    def _new_command(self, text, on_event):
+        if not self.connected:
+            raise RuntimeError("Arduino not connected")
+        cmd = Command(self._next_seq(), text, on_event)
+        with self._lock:
+            self._pending[cmd.seq] = cmd
+        return cmd
+
+    def _next_seq(self):
+        return next(self._seq)
+
+    def _write(self, data):
+        with self._write_lock:
+            self.serial.write(data)
+            self.serial.flush()
+
+    def send(self, text, on_event=None):
+        cmd = self._new_command(text.strip(), on_event)
+        self._write(f"{cmd.seq} {cmd.text}\n".encode('utf-8'))
+        return cmd
+
+    def request(self, text, on_event=None, ack_timeout=2.0, done_timeout=30.0):
+        # send and block until DONE, raises TimeoutError / DeviceError
+        return self._wait(self.send(text, on_event), ack_timeout, done_timeout)
+
+    def _wait(self, cmd, ack_timeout, done_timeout):
+        try:
+            cmd.wait_ack(ack_timeout)
+            cmd.wait_done(done_timeout)
+        finally:
+            with self._lock:
+                self._pending.pop(cmd.seq, None)
+        return cmd
+
+    def _read_loop(self):
+        buf = b""
+        while self._running:
+            try:
+                chunk = self.serial.readline()
+            except (serial.SerialException, OSError, TypeError) as e:
+                if self._running:
+                    print(f"Arduino read error: {e}")
+                    self._running = False
+                    self._fail_all(f"serial error: {e}")
+                break
+
+            if not chunk:
+                continue
+            buf += chunk
+            if not buf.endswith(b"\n"):
+                continue   # partial line, wait for the rest
+
+            line = buf.decode('utf-8', errors='replace').strip()
+            buf = b""
+            if line:
+                self._dispatch(line)
+
+    def _dispatch(self, line):
+        parts = line.split(" ", 2)
+        kind = parts[0].upper()
+
+        if kind in ("ACK", "PROGRESS", "DONE", "ERR") and len(parts) > 1 and parts[1].isdigit():
+            payload = parts[2] if len(parts) > 2 else ""
+            if self._deliver(int(parts[1]), kind, payload):
+                return
+
+        if self.on_unmatched:
+            self.on_unmatched(line)
+
+    def _deliver(self, seq, kind, payload):
+        with self._lock:
+            cmd = self._pending.get(seq)
+            if kind in ("DONE", "ERR"):
+                self._pending.pop(seq, None)
+        if cmd:
+            cmd._handle(kind, payload)
+        return cmd is not None
+
+    def _fail_all(self, reason):
+        with self._lock:
+            pending = list(self._pending.values())
+            self._pending.clear()
+        for cmd in pending:
+            cmd._handle("ERR", reason)
+
+
+class FramedLink(ArduinoLink):
+    # same command / reply matching, but over the binary frames in protocol.py:
+    # length + type + seq + crc, and a whole compiled timeline goes up in one
+    # frame with PROGRESS coming back for every step the board plays
+
+    MAX_RESENDS = 2
+    INTER_BYTE_TIMEOUT = 0.05   # a half frame with the line quiet this long is never getting finished
+
+    def __init__(self, port, baud=115200, settle=2.0, on_unmatched=None):
+        super().__init__(port, baud, settle, on_unmatched)
+        self.decoder = protocol.Decoder()
+        self.naks = 0           # our frames the board NAKed
+        self.bad_replies = 0    # board frames that failed the crc here
+
+    def _next_seq(self):
+        # u16 on the wire, 0 is kept for LOG frames
+        return (next(self._seq) - 1) % 0xFFFF + 1
+
+    def send_frame(self, msg_type, payload=b"", text=None, on_event=None):
+        cmd = self._new_command(text or protocol.NAMES[msg_type], on_event)
+        cmd.frame = protocol.encode(msg_type, cmd.seq, payload)
+        self._write(cmd.frame)
+        return cmd
+
+    def send(self, text, on_event=None):
+        # plain text commands ride along in a TEXT frame
+        text = text.strip()
+        return self.send_frame(protocol.TEXT, text.encode('utf-8'), text, on_event)
+
+    def upload(self, timeline, on_event=None, ack_timeout=2.0, done_timeout=60.0, cancel=None):
+        # push the compiled recipe and block until the board has played all of it
+        # cancel = threading.Event, setting it sends CANCEL and the pour ends in ERR
+        payload = protocol.encode_timeline(timeline)
+        text = f"TIMELINE {timeline.mood} ({len(timeline.events)} steps)"
+        cmd = self.send_frame(protocol.TIMELINE, payload, text, on_event)
+        if cancel is not None:
+            threading.Thread(target=self._cancel_when, args=(cmd, cancel),
+                             name="arduino-cancel", daemon=True).start()
+        return self._wait(cmd, ack_timeout, done_timeout)
+
+    def _cancel_when(self, cmd, cancel):
+        while not cmd.done.wait(0.05):
+            if cancel.is_set():
+                try:
+                    self.cancel()
+                except (TimeoutError, DeviceError, RuntimeError) as e:
+                    print(f"Arduino cancel failed: {e}")
+                return
+
+    def ping(self, timeout=1.0):
+        return self._wait(self.send_frame(protocol.PING), timeout, timeout).round_trip
+
+    def cancel(self, timeout=1.0):
+        return self._wait(self.send_frame(protocol.CANCEL), timeout, timeout)
+
+    def _read_loop(self):
+        last_byte = time.monotonic()
+        while self._running:
+            try:
+                chunk = self.serial.read(self.serial.in_waiting or 1)
+            except (serial.SerialException, OSError, TypeError) as e:
+                if self._running:
+                    print(f"Arduino read error: {e}")
+                    self._running = False
+                    self._fail_all(f"serial error: {e}")
+                break
+
+            lost = self.decoder.lost
+            if chunk:
+                last_byte = time.monotonic()
+                frames = self.decoder.feed(chunk)
+            elif self.decoder.buf and time.monotonic() - last_byte > self.INTER_BYTE_TIMEOUT:
+                # serial timeout with half a frame buffered: its length was
+                # probably garbled, whatever came after it is still in there
+                frames = self.decoder.flush()
+            else:
+                continue
+
+            for frame in frames:
+                try:
+                    self._dispatch_frame(frame)
+                except protocol.ProtocolError as e:
+                    # one malformed frame mustn't take the reader thread down with it
+                    if self.on_unmatched:
+                        self.on_unmatched(f"bad {protocol.NAMES.get(frame.type, frame.type)} "
+                                          f"frame {frame.seq}: {e}")
+            if self.decoder.lost != lost:
+                self._request_resend()
+
+    def _dispatch_frame(self, frame):
+        kind = protocol.NAMES.get(frame.type)
+
+        if kind == "NAK":
+            self.naks += 1
+            if frame.seq:
+                self._resend(frame.seq)
+            else:
+                # the board lost one of ours and can't tell whose, send again
+                # everything it hasn't ACKed
+                with self._lock:
+                    unacked = [seq for seq, cmd in self._pending.items() if not cmd.acked.is_set()]
+                for seq in unacked:
+                    self._resend(seq)
+            return
+        if kind == "PROGRESS":
+            payload = protocol.decode_progress(frame.payload)
+        else:
+            payload = frame.payload.decode('utf-8', errors='replace')
+
+        if kind in ("ACK", "PROGRESS", "DONE", "ERR") and self._deliver(frame.seq, kind, payload):
+            return
+        if self.on_unmatched:
+            self.on_unmatched(payload if kind == "LOG" else f"{kind or frame.type} {frame.seq} {payload}")
+
+    def _request_resend(self):
+        # a reply got lost on the way in (bad crc / cut off), so the board sends
+        # it again instead of a lost ACK / DONE turning into a timeout on a drink
+        # that poured. its seq can't be trusted, NAK every command we're still
+        # waiting on, the board resends its last frame for each
+        self.bad_replies += 1
+        with self._lock:
+            waiting = list(self._pending)
+        for seq in waiting:
+            self._write(protocol.encode(protocol.NAK, seq))
+        if not waiting and self.on_unmatched:
+            self.on_unmatched("dropped a corrupted frame from the board")
+
+    def _resend(self, seq):
+        # board lost one of ours, send the same bytes again
+        with self._lock:
+            cmd = self._pending.get(seq)
+        if cmd is None:
+            return
+        if cmd.resends >= self.MAX_RESENDS:
+            with self._lock:
+                self._pending.pop(seq, None)
+            cmd._handle("ERR", f"'{cmd.text}' corrupted {cmd.resends + 1} times")
+            return
+        cmd.resends += 1
+        self._write(cmd.frame)
+
+
+class LegacyLink(ArduinoLink):
+    # the old sketch: plain "<COMMAND>" lines with no seq and no replies. a
+    # command counts as accepted once it's written and done once the pour
+    # should be over, whatever the board prints goes to on_unmatched
+
+    def __init__(self, port, baud=115200, settle=2.0, on_unmatched=None, pour_time=2.0):
+        super().__init__(port, baud, settle, on_unmatched)
+        self.pour_time = pour_time      # how long to assume a command keeps the board busy
+
+    def send(self, text, on_event=None):
+        cmd = self._new_command(text.strip(), on_event)
+        self._write(f"{cmd.text}\n".encode('utf-8'))
+        self._deliver(cmd.seq, "ACK", "")
+        return cmd
+
+    def request(self, text, on_event=None, ack_timeout=2.0, done_timeout=30.0, busy_for=None):
+        # nothing tells us when it's finished, so wait out busy_for (close() cuts it short)
+        cmd = self.send(text, on_event)
+        busy_for = self.pour_time if busy_for is None else busy_for
+        if not cmd.done.wait(min(busy_for, done_timeout)):
+            self._deliver(cmd.seq, "DONE", "")
+        return self._wait(cmd, ack_timeout, done_timeout)
+
+    def _dispatch(self, line):
+        # no seq on anything it prints
+        if self.on_unmatched:
+            self.on_unmatched(line)
+
+
+LINKS = {"legacy": LegacyLink, "text": ArduinoLink, "framed": FramedLink}
@@ -1,49 +1,221 @@
+import argparse
+import os
+import sys
+import time
+
 import serial
 import serial.tools.list_ports
-import time
+
+import protocol
+from arduino_link import LINKS, DeviceError
 
 ARDUINO_PORT = "COM5"
 ARDUINO_BAUDRATE = 115200
 
-def connect_to_arduino():
+# protocol test tool for the framed link (protocol.py). runs a set of checks
+# against the real board, or against fake_arduino.py with --loopback:
+#   python arduino_test.py --loopback
+#   python arduino_test.py --port /dev/ttyACM0
+#   python arduino_test.py --port /dev/ttyACM0 --interactive
+#   python arduino_test.py --port /dev/ttyACM0 --protocol text --interactive
+#   python arduino_test.py --port /dev/ttyACM0 --protocol legacy --interactive
+
+def connect_to_arduino(port=ARDUINO_PORT, protocol_name="framed", settle=2.0):
     print("Available ports:")
     for p in serial.tools.list_ports.comports():
         print(f"  {p.device} | {p.description}")
 
     try:
-        ser = serial.Serial(ARDUINO_PORT, ARDUINO_BAUDRATE, timeout=1)
-        time.sleep(2)   # wait for Arduino reset
-        print(f"\nConnected to Arduino on {ARDUINO_PORT}")
-        return ser
+        # waits for the Arduino reset, works with a pty path or loop:// too
+        link_cls = LINKS[protocol_name]
+        link = link_cls(port, ARDUINO_BAUDRATE, settle=settle,
+                        on_unmatched=lambda line: print(f"<< {line}"))
+        link.open()
+        print(f"\nConnected to Arduino on {port}")
+        return link
     except Exception as e:
-        raise Exception(f"Could not open {ARDUINO_PORT}: {e}")
+        raise Exception(f"Could not open {port}: {e}")
 
-def send_and_read(ser, msg):
-    ser.write((msg + "\n").encode("utf-8"))
-    ser.flush()
+def send_and_read(link, msg, timeout=5.0):
+    # print every reply for this command as it comes in, stop at DONE/ERR
+    def on_event(kind, text):
+        print(f"<< {kind} {text}".rstrip())
 
-    # wait for response
-    time.sleep(0.2)
-    if ser.in_waiting:
-        reply = ser.readline().decode("utf-8").strip()
-        print(f"<< {reply}")
+    t0 = time.monotonic()
+    try:
+        link.request(msg, on_event, ack_timeout=timeout, done_timeout=timeout)
+        print(f"   ({(time.monotonic() - t0) * 1000:.0f} ms)")
+    except (TimeoutError, DeviceError) as e:
+        print(f"!! {e}")
 
-if __name__ == "__main__":
+# each check raises AssertionError / DeviceError / TimeoutError on failure and
+# returns a short summary line when it passes
+
+def check_ping(link, count=50):
+    times = sorted(link.ping() for _ in range(count))
+    return (f"{count} pings, p50 {times[count // 2] * 1000:.1f} ms, "
+            f"max {times[-1] * 1000:.1f} ms")
+
+def check_text(link):
+    cmd = link.request("hi", ack_timeout=2.0, done_timeout=2.0)
+    return f"TEXT frame round trip {cmd.round_trip * 1000:.1f} ms"
+
+def check_timelines(link, time_scale=1.0):
+    # every compiled recipe goes up in one frame and plays back step by step
+    from recipes import load_timelines
+
+    lines = []
+    for mood, timeline in load_timelines().items():
+        steps = []
+        cmd = link.upload(
+            timeline, lambda kind, p: steps.append(p) if kind == "PROGRESS" else None,
+            done_timeout=timeline.duration * time_scale + 5,
+        )
+        events = timeline.events
+        assert len(steps) == len(events), f"{mood}: {len(steps)} PROGRESS for {len(events)} steps"
+        for i, (p, (at, pump, on)) in enumerate(zip(steps, events)):
+            assert (p.step, p.steps, p.pump, p.on) == (i, len(events), pump, on), \
+                f"{mood} step {i}: got {p}, expected pump {pump} {'on' if on else 'off'}"
+        frame_bytes = len(protocol.encode_timeline(timeline)) + protocol.HEADER.size + protocol.CRC.size
+        lines.append(f"{mood:<9} {len(events):>2} steps, {frame_bytes:>3} byte frame, "
+                     f"{cmd.round_trip:.2f}s")
+    return "\n      ".join(lines)
+
+def check_bad_crc(link):
+    # a frame with a broken crc has to come back as a NAK
+    before = link.naks
+    frame = bytearray(protocol.encode(protocol.PING, 0xFFFF))
+    frame[-1] ^= 0xFF
+    link._write(bytes(frame))
+    deadline = time.monotonic() + 1.0
+    while link.naks == before and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert link.naks > before, "no NAK for a corrupted frame"
+    return "corrupted frame NAKed"
+
+def check_reply_crc(link, fake=None):
+    # a corrupted reply from the board gets NAKed and sent again, needs the
+    # loopback fake to do the corrupting
+    if fake is None:
+        return "skipped, needs --loopback"
+    before = link.bad_replies
+    fake.corrupt_replies = 1
+    link.ping()
+    assert link.bad_replies > before, "the fake's corrupted reply never showed up"
+    return "corrupted DONE NAKed and resent, ping answered"
+
+def check_bad_length(link, fake=None):
+    # an ACK whose length got garbled mustn't swallow the DONE behind it, the
+    # reader flushes the half frame once the line goes quiet
+    if fake is None:
+        return "skipped, needs --loopback"
+    before = link.decoder.truncated
+    fake.bad_length_replies = 1
+    cmd = link.request("hi", ack_timeout=2.0, done_timeout=2.0)
+    assert link.decoder.truncated > before, "the fake's garbled ACK never showed up"
+    return f"DONE recovered behind a garbled ACK in {cmd.round_trip * 1000:.0f} ms"
+
+def check_resync(link):
+    # line noise before a frame mustn't stop the board from finding it
+    link._write(os.urandom(64).replace(bytes([protocol.SYNC]), b"\x00"))
+    link.ping()
+    return "ping answered after 64 bytes of noise"
+
+def check_cancel(link, time_scale=1.0):
+    from recipes import load_timelines
+
+    timeline = max(load_timelines().values(), key=lambda t: t.duration)
+    steps = []
+    cmd = link.send_frame(
+        protocol.TIMELINE, protocol.encode_timeline(timeline), f"TIMELINE {timeline.mood}",
+        lambda kind, p: steps.append(p) if kind == "PROGRESS" else None,
+    )
+    cmd.wait_ack(2.0)
+    link.cancel()
     try:
-        arduino = connect_to_arduino()
+        cmd.wait_done(2.0)
+    except DeviceError as e:
+        return f"cancelled after {len(steps)}/{len(timeline.events)} steps ({e})"
+    raise AssertionError("timeline finished even though it was cancelled")
 
-        print("\nType commands: hi, LED ON, LED OFF, or EXIT")
+CHECKS = {
+    "ping": check_ping,
+    "text": check_text,
+    "timelines": check_timelines,
+    "bad_crc": check_bad_crc,
+    "reply_crc": check_reply_crc,
+    "bad_length": check_bad_length,
+    "resync": check_resync,
+    "cancel": check_cancel,
+}
 
-        while True:
-            cmd = input(">> ").strip()
+def run_checks(link, names, time_scale=1.0, fake=None):
+    failed = 0
+    for name in names:
+        fn = CHECKS[name]
+        try:
+            if name in ("timelines", "cancel"):
+                summary = fn(link, time_scale)
+            elif name in ("reply_crc", "bad_length"):
+                summary = fn(link, fake)
+            else:
+                summary = fn(link)
+            print(f"  ok    {name:<10} {summary}")
+        except (AssertionError, DeviceError, TimeoutError, protocol.ProtocolError) as e:
+            failed += 1
+            print(f"  FAIL  {name:<10} {e}")
+    print(f"\n{len(names) - failed}/{len(names)} checks passed")
+    return failed == 0
 
-            if cmd.upper() == "EXIT":
-                break
+def interactive(link):
+    print("\nType commands: hi, LED ON, LED OFF, or EXIT")
 
-            send_and_read(arduino, cmd)
+    while True:
+        cmd = input(">> ").strip()
 
-        arduino.close()
-        print("Closed serial.")
+        if cmd.upper() == "EXIT":
+            break
+
+        send_and_read(link, cmd)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Arduino protocol test tool")
+    parser.add_argument("--port", default=ARDUINO_PORT)
+    parser.add_argument("--loopback", action="store_true", help="test against fake_arduino.py instead of a board")
+    parser.add_argument("--protocol", choices=LINKS, default="framed")
+    parser.add_argument("--checks", nargs="+", choices=CHECKS, default=list(CHECKS))
+    parser.add_argument("--time-scale", type=float, default=0.05,
+                        help="how fast the loopback pours, 0.05 = 20x")
+    parser.add_argument("--interactive", action="store_true", help="type commands instead of running checks")
+    args = parser.parse_args()
+
+    fake = None
+    port, settle, time_scale = args.port, 2.0, 1.0
+    if args.loopback:
+        from fake_arduino import FakeArduino
+        fake = FakeArduino(time_scale=args.time_scale, framed=args.protocol == "framed",
+                           legacy=args.protocol == "legacy").start()
+        port, settle, time_scale = fake.port, 0, args.time_scale
 
+    try:
+        arduino = connect_to_arduino(port, args.protocol, settle=settle)
     except Exception as e:
         print(f"ERROR: {e}")
+        sys.exit(1)
+
+    ok = True
+    try:
+        if args.interactive:
+            interactive(arduino)
+        elif args.protocol != "framed":
+            print("The checks need --protocol framed, use --interactive for the line protocols")
+            ok = False
+        else:
+            print()
+            ok = run_checks(arduino, args.checks, time_scale, fake)
+    finally:
+        arduino.close()
+        if fake:
+            fake.stop()
+        print("Closed serial.")
+    sys.exit(0 if ok else 1)
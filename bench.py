@@ -0,0 +1,433 @@
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+
+# pumps.py grabs gpio pins on import, use gpiozero's mock pins instead
+os.environ.setdefault("GPIOZERO_PIN_FACTORY", "mock")
+
+import numpy as np
+
+from config import DETECTOR, HOLD_FRAMES, HOLD_GATE, HOLD_SECS, MIN_NEIGHBORS, SCALE_FACTOR
+
+# runs the scan + dispense code with stand-ins for the hardware:
+#   camera  -> SyntheticSource / FileSource (camera.py)
+#   arduino -> FakeArduino on a pty (fake_arduino.py)
+#   pumps   -> gpiozero mock pins
+# python bench.py --video clip.mp4 --save baseline.json
+# python bench.py --video clip.mp4 --compare baseline.json
+
+
+def percentiles(samples):
+    if not samples:
+        return {}
+    ms = np.asarray(samples) * 1000
+    return {
+        "n": len(samples),
+        "p50_ms": float(np.percentile(ms, 50)),
+        "p90_ms": float(np.percentile(ms, 90)),
+        "p99_ms": float(np.percentile(ms, 99)),
+        "max_ms": float(ms.max()),
+    }
+
+
+def make_source(args, width, height):
+    from camera import FileSource, SyntheticSource
+
+    if args.video:
+        return FileSource(args.video, width, height)
+    return SyntheticSource(width, height, fps=args.camera_fps, face=args.face)
+
+
+def timed(fn, samples):
+    def wrapper(*a):
+        t0 = time.perf_counter()
+        out = fn(*a)
+        samples.append(time.perf_counter() - t0)
+        return out
+    return wrapper
+
+
+def bench_preview(args, width=640, height=380, radius=40, source=None, governor=None):
+    # same capture -> (detect, render) pipeline the scanner screen runs
+    import kiosk
+    from camera import CameraManager
+    from detector import FaceTracker, HoldStill, make_detector
+    from overlay import PreviewCompositor, RING_RED
+    from pipeline import LatestQueue, Pipeline, Stage
+
+    camera = CameraManager(source or make_source(args, width, height), mirror=True, pool_size=6)
+    camera.acquire()
+    tracker = FaceTracker(make_detector(args.detector, SCALE_FACTOR, MIN_NEIGHBORS))
+    hold = HoldStill(HOLD_SECS, HOLD_GATE, max_faces=HOLD_FRAMES)
+    compositor = PreviewCompositor(width, height, radius)
+
+    # PhotoImage needs a display, skip that part if there isn't one
+    tk_root = photo = None
+    try:
+        import tkinter as tk
+        from PIL import ImageTk
+        tk_root = tk.Tk()
+        tk_root.withdraw()
+        photo = ImageTk.PhotoImage("RGBA", compositor.image.size)
+    except Exception:
+        pass
+
+    state = {"color": RING_RED, "hits": 0, "frames": 0, "captures": 0}
+    detect_samples, render_samples = [], []
+
+    def detect(frame):
+        # the scanner screen's detect stage, minus tk. a capture just starts
+        # the next hold instead of handing off to the model
+        scan, power = kiosk.scan_step(tracker, hold, frame, time.time(), governor)
+        if scan == "captured":
+            state["captures"] += 1
+            hold.reset()
+        state["frames"] += 1
+        state["hits"] += tracker.last_box is not None
+        state["color"], _ = kiosk.scan_feedback(scan, power)
+
+    def render(frame):
+        if governor and not governor.profile.render:
+            return
+        img = compositor.compose_image(frame, state["color"], camera.flip_in_blit)
+        if photo is not None:
+            photo.paste(img)
+
+    detect_q, render_q = LatestQueue(), LatestQueue()
+    capture = Stage("capture", camera.capture, outputs=[detect_q, render_q])
+    pipeline = Pipeline([
+        capture,
+        Stage("detect", timed(detect, detect_samples), inbox=detect_q),
+        Stage("render", timed(render, render_samples), inbox=render_q, max_rate=30),
+    ], pool=camera.pool)
+    if governor:
+        def apply(name, profile):
+            capture.set_rate(profile.capture_fps)
+            tracker.scale = profile.detect_scale
+        governor.on_change = apply
+        governor.reset()
+
+    wall0, cpu0 = time.monotonic(), time.process_time()
+    pipeline.start()
+    time.sleep(args.seconds)
+    pipeline.stop()
+    cpu_pct = (time.process_time() - cpu0) / (time.monotonic() - wall0) * 100
+    if governor:
+        governor.pause()
+    camera.close()
+    if tk_root is not None:
+        tk_root.destroy()
+
+    stats = {name: st["count"] / args.seconds for name, st in pipeline.stats().items()}
+    return {
+        "preview_fps": stats["render"],
+        "capture_fps": stats["capture"],
+        "detect_fps": stats["detect"],
+        "face_hit_rate": state["hits"] / max(state["frames"], 1),
+        "captures": state["captures"],
+        "detect_latency": percentiles(detect_samples),
+        "render_latency": percentiles(render_samples),
+        "cpu_pct": cpu_pct,
+        "photoimage": tk_root is not None,
+        "pool_misses": camera.pool.misses,
+        "full_searches": tracker.full_searches,
+        "roi_searches": tracker.roi_searches,
+    }
+
+
+def bench_alloc(args, width=640, height=380, radius=40, frames=300):
+    # steady-state capture -> (detect, render) through the same Pipeline / Stage
+    # code the scanner screen runs, under tracemalloc. with the frame pool + dst=
+    # buffers the peak above the warmed up baseline has to stay under
+    # --alloc-budget-kib, otherwise the section fails and bench exits 1
+    import tracemalloc
+
+    from camera import CameraManager, SyntheticSource
+    from detector import FaceTracker, make_detector
+    from overlay import PreviewCompositor, RING_GREEN, RING_RED
+    from pipeline import LatestQueue, Pipeline, Stage
+
+    camera = CameraManager(SyntheticSource(width, height, fps=0, face=args.face), mirror=True, pool_size=6)
+    camera.acquire()
+    tracker = FaceTracker(make_detector(args.detector, SCALE_FACTOR, MIN_NEIGHBORS))
+    compositor = PreviewCompositor(width, height, radius)
+    state = {"color": RING_RED}
+
+    def detect(frame):
+        state["color"] = RING_GREEN if tracker.detect(frame) else RING_RED
+
+    def render(frame):
+        compositor.compose(frame, state["color"], camera.flip_in_blit)
+
+    detect_q, render_q = LatestQueue(), LatestQueue()
+    detect_stage = Stage("detect", detect, inbox=detect_q)
+    pipeline = Pipeline([
+        Stage("capture", camera.capture, outputs=[detect_q, render_q], max_rate=60),
+        detect_stage,
+        Stage("render", render, inbox=render_q),
+    ], pool=camera.pool)
+
+    def wait_for(count, deadline):
+        while detect_stage.stats.count < count and detect_stage.running and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    deadline = time.monotonic() + max(args.seconds * 6, 30)
+    tracemalloc.start()
+    pipeline.start()
+    wait_for(30, deadline)      # threads, caches, scratch buffers, histograms
+    baseline, _ = tracemalloc.get_traced_memory()
+    tracemalloc.reset_peak()
+    wait_for(30 + frames, deadline)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    measured = detect_stage.stats.count - 30
+    pipeline.stop()
+    camera.close()
+
+    frame_bytes = width * height * 3
+    peak_kib = (peak - baseline) / 1024
+    out = {
+        "frames": measured,
+        "frame_kib": frame_bytes / 1024,
+        "budget_kib": args.alloc_budget_kib,
+        "peak_over_baseline_kib": peak_kib,
+        "growth_kib": (current - baseline) / 1024,
+        "pool_misses": camera.pool.misses,
+    }
+    if measured < frames:
+        out["failed"] = f"pipeline only got through {measured}/{frames} frames"
+    elif peak_kib > args.alloc_budget_kib:
+        out["failed"] = f"peak {peak_kib:.1f} KiB over the {args.alloc_budget_kib} KiB budget"
+    elif camera.pool.misses:
+        out["failed"] = f"{camera.pool.misses} frames allocated outside the pool"
+    return out
+
+
+def bench_power(args, width=640, height=380):
+    # nobody in front of the camera: fixed full rate vs the adaptive governor
+    from camera import SyntheticSource
+    from pipeline import PowerGovernor
+
+    def empty():
+        return SyntheticSource(width, height, fps=args.camera_fps)
+
+    fixed = bench_preview(args, width, height, source=empty())
+    governor = PowerGovernor(idle_after=min(1.0, args.seconds / 4))
+    adaptive = bench_preview(args, width, height, source=empty(), governor=governor)
+    return {
+        "fixed_cpu_pct": fixed["cpu_pct"],
+        "adaptive_cpu_pct": adaptive["cpu_pct"],
+        "per_state": {name: r for name, r in governor.report().items() if r["wall_s"]},
+    }
+
+
+def bench_scan(args, width=640, height=380):
+    # time from the first frame with a face to having the emotion dict, through
+    # the same scan_step / analyze_faces the kiosk runs
+    import kiosk
+    from camera import CameraManager
+    from detector import FaceTracker, HoldStill, make_detector
+    from emotion import EmotionService
+
+    service = EmotionService()
+    service.start()
+    if not service.wait(300):
+        return {"skipped": service.error}
+
+    camera = CameraManager(make_source(args, width, height), mirror=True)
+    camera.acquire()
+    tracker = FaceTracker(make_detector(args.detector, SCALE_FACTOR, MIN_NEIGHBORS))
+    hold = HoldStill(HOLD_SECS, HOLD_GATE, max_faces=HOLD_FRAMES)
+
+    scan_samples, infer_samples = [], []
+    deadline = time.monotonic() + args.seconds * 4
+    while len(scan_samples) < args.scans and time.monotonic() < deadline:
+        tracker.reset()
+        hold.reset()
+        state, t_first = None, None
+        while state != "captured" and time.monotonic() < deadline:
+            state, _ = kiosk.scan_step(tracker, hold, camera.capture(), time.time())
+            if tracker.last_box is not None and t_first is None:
+                t_first = hold.start
+        if state != "captured":
+            break
+
+        crops = kiosk.take_crops(hold, time.time())
+        t0 = time.time()
+        kiosk.analyze_faces(service, crops)
+        t1 = time.time()
+        infer_samples.append(t1 - t0)
+        scan_samples.append(t1 - t_first)
+
+    camera.close()
+    if not scan_samples:
+        return {"skipped": "no faces found in the frame source (try --video or --face)"}
+    return {
+        "scan_to_result": percentiles(scan_samples),
+        "inference": percentiles(infer_samples),
+        "model_load_s": service.load_time,
+    }
+
+
+def scaled(timeline, scale):
+    return timeline._replace(
+        events=tuple((at * scale, pump, on) for at, pump, on in timeline.events),
+        duration=timeline.duration * scale,
+    )
+
+
+def bench_dispense_serial(args):
+    # every link protocol through kiosk.dispense, the real links against a pty fake
+    import kiosk
+    from arduino_link import LINKS
+    from fake_arduino import FakeArduino
+    from recipes import load_timelines
+
+    out = {"time_scale": args.time_scale}
+    for name, link_cls in LINKS.items():
+        fake = FakeArduino(time_scale=args.time_scale, framed=name == "framed", legacy=name == "legacy").start()
+        link = link_cls(fake.port, settle=0).open()
+
+        wall, overhead = {}, []
+        for mood in load_timelines():
+            timeline = kiosk.choose_timeline(mood, blendable=kiosk.can_blend("arduino", name))
+            pour = timeline.duration * args.time_scale
+            if name == "legacy":
+                # the fake already pours time_scale faster, the host's blind wait has to match
+                timeline = scaled(timeline, args.time_scale)
+            t0 = time.perf_counter()
+            kiosk.dispense(mood, timeline, lambda msg: None, link=link, protocol=name,
+                           done_timeout=pour + 5)
+            wall[mood] = time.perf_counter() - t0
+            overhead.append(wall[mood] - pour)
+
+        link.close()
+        fake.stop()
+        out[name] = {"wall_s": wall, "overhead": percentiles(overhead)}
+    return out
+
+
+def bench_pumps(args):
+    # sequential run_recipe vs the compiled timeline through kiosk.dispense, on mock pins
+    import kiosk
+    import pumps
+    from recipes import load_timelines
+
+    drinks = dict(load_timelines())
+    # a mixed mood the way start_drink_flow would blend it
+    drinks["BLEND"] = kiosk.choose_timeline("HAPPY", {"happy": 55, "sad": 30, "neutral": 15},
+                                            blendable=kiosk.can_blend("gpio", None))
+
+    out = {}
+    for mood, timeline in drinks.items():
+        t = scaled(timeline, args.time_scale)
+        steps = [(pump, at_off - at_on) for (at_on, pump, on), (at_off, _, _) in _on_off_pairs(t)]
+
+        t0 = time.perf_counter()
+        pumps.run_recipe(steps, max_active=1)
+        sequential = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        kiosk.dispense(mood, t, lambda msg: None, dispenser="gpio")
+        compiled = time.perf_counter() - t0
+
+        out[mood] = {"sequential_s": sequential, "timeline_s": compiled}
+    return {"per_drink": out, "time_scale": args.time_scale}
+
+
+def _on_off_pairs(timeline):
+    ons = {}
+    for ev in timeline.events:
+        if ev[2]:
+            ons[ev[1]] = ev
+        else:
+            yield ons.pop(ev[1]), ev
+
+
+def flatten(d, prefix=""):
+    out = {}
+    for k, v in d.items():
+        key = f"{prefix}{k}"
+        if isinstance(v, dict):
+            out.update(flatten(v, key + "."))
+        elif isinstance(v, (int, float)) and not isinstance(v, bool):
+            out[key] = v
+    return out
+
+
+def compare(old, new):
+    old_f, new_f = flatten(old["results"]), flatten(new["results"])
+    print(f"\n  {'metric':<44} {'baseline':>10} {'now':>10} {'change':>8}")
+    print("  " + "-" * 76)
+    for key in sorted(new_f):
+        if key not in old_f:
+            continue
+        a, b = old_f[key], new_f[key]
+        change = f"{(b - a) / a * 100:+.1f}%" if a else ""
+        print(f"  {key:<44} {a:>10.2f} {b:>10.2f} {change:>8}")
+
+
+SECTIONS = {
+    "preview": bench_preview,
+    "power": bench_power,
+    "alloc": bench_alloc,
+    "scan": bench_scan,
+    "serial": bench_dispense_serial,
+    "pumps": bench_pumps,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="MoodMixer benchmarks, no hardware needed")
+    parser.add_argument("--only", nargs="+", choices=SECTIONS, help="run just these sections")
+    parser.add_argument("--video", help="video file or image folder to use as the camera")
+    parser.add_argument("--face", help="image pasted into the synthetic frames")
+    parser.add_argument("--detector", default=DETECTOR, help="haar / lbp / yunet")
+    parser.add_argument("--camera-fps", type=float, default=30)
+    parser.add_argument("--seconds", type=float, default=5, help="how long to run the preview")
+    parser.add_argument("--scans", type=int, default=5)
+    parser.add_argument("--time-scale", type=float, default=0.1, help="speed up pours, 0.1 = 10x")
+    parser.add_argument("--alloc-budget-kib", type=float, default=64,
+                        help="max steady-state allocation peak for the alloc section")
+    parser.add_argument("--save", help="write results to this json file")
+    parser.add_argument("--compare", help="baseline json to compare against")
+    args = parser.parse_args()
+
+    results = {}
+    for name in args.only or SECTIONS:
+        print(f"running {name}...")
+        results[name] = SECTIONS[name](args)
+
+    report = {
+        "meta": {
+            "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "node": platform.node(),
+            "args": vars(args),
+        },
+        "results": results,
+    }
+    print(json.dumps(results, indent=2))
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), report)
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"saved {args.save}")
+
+    # sections that check something (alloc) say why they failed
+    failed = {name: r["failed"] for name, r in results.items() if r.get("failed")}
+    for name, reason in failed.items():
+        print(f"FAILED {name}: {reason}")
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,320 @@
+import os
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from metrics import METRICS
+
+# every source's capture(out=None) writes into out when it's given one, so the
+# scan loop can run on a FramePool with no per-frame allocations
+
+
+class FramePool:
+    # preallocated frame buffers handed out with a refcount. the capture stage
+    # acquires one, every queue it goes into retains it, every consumer releases
+    # it when done, and at zero it goes back on the free list
+    # runs dry -> allocates another one and counts a miss
+
+    def __init__(self, shape, dtype=np.uint8, size=6):
+        self.shape = shape
+        self.dtype = dtype
+        self.size = size
+        self.misses = 0
+        self._free = [np.empty(shape, dtype) for _ in range(size)]
+        self._refs = {}     # id(buf) -> [buf, count], keeps lent-out buffers alive
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            buf = self._free.pop() if self._free else None
+            if buf is None:
+                self.misses += 1
+                self.size += 1
+        if buf is None:
+            buf = np.empty(self.shape, self.dtype)
+        with self._lock:
+            self._refs[id(buf)] = [buf, 1]
+        return buf
+
+    def retain(self, buf, n=1):
+        with self._lock:
+            entry = self._refs.get(id(buf))
+            if entry is not None:
+                entry[1] += n
+
+    def release(self, buf):
+        # anything that didn't come from this pool is ignored
+        with self._lock:
+            entry = self._refs.get(id(buf))
+            if entry is None:
+                return
+            entry[1] -= 1
+            if entry[1] <= 0:
+                del self._refs[id(buf)]
+                self._free.append(buf)
+
+    @property
+    def in_use(self):
+        with self._lock:
+            return len(self._refs)
+
+
+class PicameraSource:
+    # the real pi camera, configured once and then just started/stopped
+    # hflip gets done by the isp for free, so the mirror never costs a copy
+
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.hflip = False
+        self.picam2 = None
+        self._mapped = None
+
+    def open(self):
+        from libcamera import Transform
+        from picamera2 import MappedArray, Picamera2
+
+        self._mapped = MappedArray
+        self.picam2 = Picamera2()
+        config = self.picam2.create_preview_configuration(
+            main={"size": (self.width, self.height), "format": "RGB888"},
+            transform=Transform(hflip=self.hflip),
+        )
+        self.picam2.configure(config)
+
+    def start(self):
+        self.picam2.start()
+
+    def stop(self):
+        self.picam2.stop()
+
+    def capture(self, out=None):
+        if out is None:
+            return self.picam2.capture_array()
+        # copy straight out of the dma buffer into ours, capture_array would allocate
+        request = self.picam2.capture_request()
+        try:
+            with self._mapped(request, "main") as m:
+                np.copyto(out, m.array)
+        finally:
+            request.release()
+        return out
+
+    def close(self):
+        if self.picam2:
+            self.picam2.close()
+            self.picam2 = None
+
+
+class SyntheticSource:
+    # moving gradient frames at a fixed rate, optionally with a face image pasted in
+
+    def __init__(self, width, height, fps=30, face=None):
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.face = face
+        self._frame = np.zeros((height, width, 3), dtype=np.uint8)
+        self._n = 0
+        self._next = 0.0
+
+    def open(self):
+        ramp = np.linspace(0, 255, self.width, dtype=np.uint8)
+        self._base = np.broadcast_to(ramp[None, :, None], self._frame.shape).copy()
+        if isinstance(self.face, str):
+            self.face = cv2.imread(self.face)
+
+    def start(self):
+        self._next = time.monotonic()
+
+    def stop(self):
+        pass
+
+    def capture(self, out=None):
+        # pace like a real sensor would
+        if self.fps:
+            self._next += 1.0 / self.fps
+            delay = self._next - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+
+        self._n += 1
+        out = self._frame if out is None else out
+        # np.roll without the temporary
+        shift = (self._n * 4) % self.width
+        out[:, shift:] = self._base[:, :self.width - shift]
+        out[:, :shift] = self._base[:, self.width - shift:]
+        if self.face is not None:
+            fh, fw = self.face.shape[:2]
+            y, x = (self.height - fh) // 2, (self.width - fw) // 2
+            out[y:y + fh, x:x + fw] = self.face
+        return out
+
+    def close(self):
+        pass
+
+
+class FileSource:
+    # frames from a video file or a directory of images, loops at the end
+
+    IMAGE_EXTS = (".jpg", ".jpeg", ".png", ".bmp")
+
+    def __init__(self, path, width, height, loop=True):
+        self.path = path
+        self.width = width
+        self.height = height
+        self.loop = loop
+        self._cap = None
+        self._raw = None    # decode buffer when the video isn't already width x height
+        self._native = False
+        self._images = None
+        self._i = 0
+
+    def open(self):
+        if os.path.isdir(self.path):
+            self._images = sorted(
+                os.path.join(self.path, f) for f in os.listdir(self.path)
+                if f.lower().endswith(self.IMAGE_EXTS)
+            )
+            if not self._images:
+                raise FileNotFoundError(f"No images in {self.path}")
+        else:
+            self._cap = cv2.VideoCapture(self.path)
+            if not self._cap.isOpened():
+                raise FileNotFoundError(f"Can't open video {self.path}")
+            self._native = (
+                int(self._cap.get(cv2.CAP_PROP_FRAME_WIDTH)) == self.width
+                and int(self._cap.get(cv2.CAP_PROP_FRAME_HEIGHT)) == self.height
+            )
+
+    @property
+    def fps(self):
+        # native frame rate of the video, None for image folders
+        if self._cap is None:
+            return None
+        return self._cap.get(cv2.CAP_PROP_FPS) or None
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def _read(self, into=None):
+        if self._images is not None:
+            if self._i >= len(self._images):
+                if not self.loop:
+                    return None
+                self._i = 0
+            frame = cv2.imread(self._images[self._i])
+            self._i += 1
+            return frame
+
+        ok, frame = self._cap.read(into)
+        if not ok and self.loop:
+            self._cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            ok, frame = self._cap.read(into)
+        return frame if ok else None
+
+    def capture(self, out=None):
+        # decode into out if the sizes match, otherwise into _raw and resize into out
+        frame = self._read(out if self._native else self._raw)
+        if frame is None:
+            raise EOFError(f"End of {self.path}")
+        if frame.shape[1] != self.width or frame.shape[0] != self.height:
+            if self._images is None:
+                self._raw = frame
+            return cv2.resize(frame, (self.width, self.height), dst=out)
+        if out is not None and frame is not out:
+            np.copyto(out, frame)
+            return out
+        return frame
+
+    def close(self):
+        if self._cap is not None:
+            self._cap.release()
+            self._cap = None
+
+
+class CameraManager:
+    # opens the camera once and keeps it paused between scans so the next
+    # customer doesn't wait on sensor init
+    # states: closed -> opening -> paused <-> streaming
+
+    def __init__(self, source, mirror=False, pool_size=0):
+        # mirror: the isp flips it if the source can (picamera), otherwise the frames
+        # stay as they are and the preview blit mirrors them, see flip_in_blit
+        # pool_size: hand out FramePool buffers, the caller has to pool.release() them
+        self.source = source
+        self.mirror = mirror
+        self.pool_size = pool_size
+        self.pool = None
+        if mirror and hasattr(source, "hflip"):
+            source.hflip = True
+        self.state = "closed"
+        self.error = None
+        self.first_frame_latency = None
+        self._lock = threading.Lock()
+        self._acquired_at = None
+
+    @property
+    def ready(self):
+        return self.state in ("paused", "streaming")
+
+    @property
+    def flip_in_blit(self):
+        return self.mirror and not getattr(self.source, "hflip", False)
+
+    def open(self):
+        with self._lock:
+            if self.state != "closed":
+                return
+            self.state = "opening"
+            try:
+                self.source.open()
+                if self.pool_size:
+                    self.pool = FramePool((self.source.height, self.source.width, 3), size=self.pool_size)
+                self.state = "paused"
+            except Exception as e:
+                self.error = str(e)
+                self.state = "closed"
+                raise
+
+    def acquire(self):
+        # start handing out frames, opens the camera if nobody did yet
+        self.open()
+        with self._lock:
+            if self.state == "paused":
+                self.source.start()
+                self.state = "streaming"
+                self._acquired_at = time.monotonic()
+                self.first_frame_latency = None
+
+    def capture(self):
+        buf = self.pool.acquire() if self.pool else None
+        try:
+            with METRICS.time("frame_capture"):
+                frame = self.source.capture(buf)
+        except Exception:
+            if buf is not None:
+                self.pool.release(buf)
+            raise
+        if self.first_frame_latency is None and self._acquired_at is not None:
+            self.first_frame_latency = time.monotonic() - self._acquired_at
+        return frame
+
+    def release(self):
+        # pause, but keep the camera open and configured
+        with self._lock:
+            if self.state == "streaming":
+                self.source.stop()
+                self.state = "paused"
+
+    def close(self):
+        with self._lock:
+            if self.state == "streaming":
+                self.source.stop()
+            self.source.close()
+            self.state = "closed"
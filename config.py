@@ -0,0 +1,10 @@
+# detection thresholds shared by the kiosk (main.py), replay.py and bench.py.
+# kept out of main.py so the headless tools can read them without pulling in
+# tkinter, tune them offline with replay.py
+
+DETECTOR = "haar"     # haar / lbp / yunet, compare them with detector.py
+SCALE_FACTOR = 1.2    # cascade scale step (haar/lbp)
+MIN_NEIGHBORS = 5     # cascade min neighbours (haar/lbp)
+HOLD_SECS = 2.0       # full hold-still window
+HOLD_GATE = 0.25      # take the picture this far into it (once HOLD_FRAMES crops are in)
+HOLD_FRAMES = 8       # face frames averaged into one mood reading
@@ -0,0 +1,255 @@
+import argparse
+import os
+import time
+from collections import deque
+
+import cv2
+import numpy as np
+
+from metrics import METRICS
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+MODELS_DIR = os.path.join(HERE, "models")
+
+# detector backends, all opencv only. pick one with make_detector(name) /
+# DETECTOR in config.py, and compare them with:
+#   python detector.py path/to/face/images --backends haar lbp yunet
+# lbp and yunet need their model files in models/ (not shipped with opencv-python):
+#   lbpcascade_frontalface_improved.xml  (opencv/data/lbpcascades)
+#   face_detection_yunet_2023mar.onnx    (opencv_zoo/models/face_detection_yunet)
+
+
+class CascadeBackend:
+    # haar or lbp cascade, works on gray
+    color = False
+
+    def __init__(self, path, scale_factor=1.2, min_neighbors=5, min_size=(24, 24)):
+        self.cascade = cv2.CascadeClassifier(path)
+        if self.cascade.empty():
+            raise FileNotFoundError(f"Can't load cascade {path}")
+        self.scale_factor = scale_factor
+        self.min_neighbors = min_neighbors
+        self.min_size = min_size
+
+    def detect(self, gray):
+        faces = self.cascade.detectMultiScale(
+            gray, self.scale_factor, self.min_neighbors, minSize=self.min_size
+        )
+        return [tuple(int(v) for v in f) for f in faces]
+
+
+class YuNetBackend:
+    # opencv's small cnn face detector, works on BGR
+    color = True
+
+    def __init__(self, path, score_threshold=0.8, nms_threshold=0.3, top_k=50, min_size=(24, 24)):
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"Can't find YuNet model {path}")
+        self.net = cv2.FaceDetectorYN.create(path, "", (320, 320), score_threshold, nms_threshold, top_k)
+        self.min_size = min_size
+        self._input_size = None
+
+    def detect(self, bgr):
+        h, w = bgr.shape[:2]
+        if (w, h) != self._input_size:
+            self.net.setInputSize((w, h))
+            self._input_size = (w, h)
+
+        _, faces = self.net.detect(bgr)
+        if faces is None:
+            return []
+        boxes = []
+        for f in faces:
+            x, y, fw, fh = (int(v) for v in f[:4])
+            if fw >= self.min_size[0] and fh >= self.min_size[1]:
+                boxes.append((max(x, 0), max(y, 0), fw, fh))
+        return boxes
+
+
+BACKENDS = {
+    "haar": lambda sf, mn: CascadeBackend(
+        cv2.data.haarcascades + "haarcascade_frontalface_default.xml", sf, mn),
+    "lbp": lambda sf, mn: CascadeBackend(
+        os.path.join(MODELS_DIR, "lbpcascade_frontalface_improved.xml"), sf, mn),
+    "yunet": lambda sf, mn: YuNetBackend(
+        os.path.join(MODELS_DIR, "face_detection_yunet_2023mar.onnx")),
+}
+
+
+def make_detector(name="haar", scale_factor=1.2, min_neighbors=5):
+    # scale_factor / min_neighbors only mean something to the cascades
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown detector '{name}', pick one of {', '.join(BACKENDS)}")
+    return BACKENDS[name](scale_factor, min_neighbors)
+
+
+class FaceTracker:
+    # runs the detector on a downscaled frame, then only around the last face
+    # until the track is lost
+
+    def __init__(self, backend, scale=0.5, pad=0.5):
+        self.backend = backend
+        self.scale = scale          # downscale factor for the search image
+        self.pad = pad              # how much to grow the last box by (fraction of its size)
+
+        self.last_box = None
+        self.full_searches = 0      # whole-frame searches (no track, or the roi missed)
+        self.roi_searches = 0       # searches around the last face
+
+        # reused dst= buffers, so a detect call doesn't allocate frame sized arrays
+        self._gray = None
+        self._small = None
+
+    def reset(self):
+        self.last_box = None
+        self.full_searches = 0
+        self.roi_searches = 0
+
+    def summary(self):
+        # lots of full searches next to the roi ones means the track keeps getting lost
+        total = self.full_searches + self.roi_searches
+        roi = self.roi_searches / total * 100 if total else 0.0
+        return f"{self.full_searches} full / {self.roi_searches} roi searches ({roi:.0f}% roi)"
+
+    def _buffer(self, buf, shape):
+        # buf if it's at least shape big, otherwise a new one that is
+        if buf is None or buf.ndim != len(shape) or any(b < s for b, s in zip(buf.shape, shape)):
+            return np.empty(shape, np.uint8)
+        return buf
+
+    def _search(self, image, x_off=0, y_off=0):
+        h, w = image.shape[:2]
+        sw, sh = max(round(w * self.scale), 1), max(round(h * self.scale), 1)
+        # roi sizes change every frame, so resize into a corner of one big scratch buffer
+        self._small = self._buffer(self._small, (max(h, sh), max(w, sw)) + image.shape[2:])
+        small = cv2.resize(image, (sw, sh), dst=self._small[:sh, :sw], interpolation=cv2.INTER_AREA)
+        faces = self.backend.detect(small)
+
+        # back to full frame coords
+        inv = 1.0 / self.scale
+        return [
+            (int(x * inv) + x_off, int(y * inv) + y_off, int(w * inv), int(h * inv))
+            for (x, y, w, h) in faces
+        ]
+
+    def detect(self, frame):
+        # takes gray or BGR, converts only if the backend wants gray
+        if frame.ndim == 3 and not self.backend.color:
+            with METRICS.time("flip_convert"):
+                self._gray = self._buffer(self._gray, frame.shape[:2])
+                image = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY, dst=self._gray[:frame.shape[0], :frame.shape[1]])
+        else:
+            image = frame
+
+        with METRICS.time("face_detect"):
+            return self._track(image)
+
+    def _track(self, image):
+        faces = []
+
+        if self.last_box is not None:
+            x, y, w, h = self.last_box
+            px, py = int(w * self.pad), int(h * self.pad)
+            H, W = image.shape[:2]
+            x0, y0 = max(x - px, 0), max(y - py, 0)
+            x1, y1 = min(x + w + px, W), min(y + h + py, H)
+
+            # slicing is a view so the roi costs nothing to cut out
+            self.roi_searches += 1
+            faces = self._search(image[y0:y1, x0:x1], x0, y0)
+
+        if not faces:
+            # no track or we lost it, search the whole frame
+            self.full_searches += 1
+            faces = self._search(image)
+
+        if faces:
+            # follow the biggest face
+            self.last_box = max(faces, key=lambda f: f[2] * f[3])
+        else:
+            self.last_box = None
+
+        return faces
+
+
+class HoldStill:
+    # the "hold still" gate: a face has to stay in frame for gate * hold_secs
+    # and for at least max_faces frames before we take it, the last max_faces
+    # crops get kept for the emotion batch (at low fps the frame count is what
+    # holds it back, not the clock)
+    # shared by the kiosk and replay.py so thresholds tuned offline mean the same thing
+
+    def __init__(self, hold_secs=2.0, gate=0.25, max_faces=8, margin=0.1):
+        self.hold_secs = hold_secs
+        self.gate = gate
+        self.margin = margin
+        self.faces = deque(maxlen=max_faces)
+        self.start = None
+        self.progress = 0.0
+
+    def reset(self):
+        self.start = None
+        self.progress = 0.0
+        self.faces.clear()
+
+    def update(self, frame, box, now):
+        # box is the tracked face (or None), now is seconds (wall clock or video time)
+        # returns "searching", "holding" or "captured"
+        if box is None:
+            self.reset()
+            return "searching"
+
+        if self.start is None:
+            self.start = now
+            self.faces.clear()
+
+        x, y, w, h = box
+        m = int(w * self.margin)
+        self.faces.append(frame[max(y - m, 0):y + h + m, max(x - m, 0):x + w + m].copy())
+
+        self.progress = min((now - self.start) / self.hold_secs, 1.0)
+        if self.progress >= self.gate and len(self.faces) == self.faces.maxlen:
+            return "captured"
+        return "holding"
+
+
+def compare(image_dir, names, scale=1.0, width=640, height=380):
+    # speed + hit rate of each backend over a folder of images that all have a face in them
+    paths = sorted(
+        os.path.join(image_dir, f) for f in os.listdir(image_dir)
+        if f.lower().endswith((".jpg", ".jpeg", ".png", ".bmp"))
+    )
+    images = [cv2.resize(cv2.imread(p), (width, height)) for p in paths]
+    if not images:
+        raise FileNotFoundError(f"No images in {image_dir}")
+
+    print(f"\n  {len(images)} images at {width}x{height}, search scale {scale}")
+    print(f"  {'backend':<8} {'fps':>8} {'ms/img':>8} {'hit rate':>9} {'faces':>6}")
+    print("  " + "-" * 44)
+    for name in names:
+        try:
+            backend = make_detector(name)
+        except (FileNotFoundError, cv2.error) as e:
+            print(f"  {name:<8} skipped: {e}")
+            continue
+
+        hits = found = 0
+        t0 = time.perf_counter()
+        for img in images:
+            # fresh tracker per image so every one is a full-frame search
+            faces = FaceTracker(backend, scale=scale).detect(img)
+            hits += bool(faces)
+            found += len(faces)
+        elapsed = time.perf_counter() - t0
+
+        print(f"  {name:<8} {len(images) / elapsed:8.1f} {elapsed / len(images) * 1000:8.1f}"
+              f" {hits / len(images):9.1%} {found:6d}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare face detector backends on a folder of images")
+    parser.add_argument("images", help="folder of images, each with a face in it")
+    parser.add_argument("--backends", nargs="+", default=list(BACKENDS), choices=BACKENDS)
+    parser.add_argument("--scale", type=float, default=0.5, help="downscale before detecting, like the kiosk")
+    args = parser.parse_args()
+    compare(args.images, args.backends, args.scale)
@@ -0,0 +1,74 @@
+import threading
+import time
+
+from metrics import METRICS
+
+_UNSET = object()
+
+
+class UIDispatcher:
+    # worker threads post(key, fn, value) instead of root.after(0, ...)
+    # only the newest value per key is kept, and everything pending gets applied
+    # once per display tick on the tk thread, so tk's queue never backs up
+
+    def __init__(self, root, fps=30):
+        self.root = root
+        self.interval_ms = max(int(1000 / fps), 1)
+        self.dropped = 0    # superseded before they were shown
+        self.skipped = 0    # same value as what's already on screen
+        self._pending = {}
+        self._last = {}
+        self._lock = threading.Lock()
+        self._running = False
+
+    def start(self):
+        if not self._running:
+            self._running = True
+            self.root.after(self.interval_ms, self._tick)
+
+    def stop(self):
+        self._running = False
+
+    def post(self, key, fn, value, dedupe=False):
+        # dedupe=True skips it if the screen already shows this value (status text etc)
+        with self._lock:
+            if dedupe and key not in self._pending and self._last.get(key, _UNSET) == value:
+                self.skipped += 1
+                return
+            if key in self._pending:
+                self.dropped += 1
+            self._pending[key] = (fn, value, dedupe, time.perf_counter())
+
+    def forget(self, key=None):
+        # screen changed, drop whatever was pending/remembered for it
+        with self._lock:
+            if key is None:
+                self._pending.clear()
+                self._last.clear()
+            else:
+                self._pending.pop(key, None)
+                self._last.pop(key, None)
+
+    def _tick(self):
+        if not self._running:
+            return
+
+        with self._lock:
+            pending, self._pending = self._pending, {}
+
+        now = time.perf_counter()
+        for key, (fn, value, dedupe, posted) in pending.items():
+            with self._lock:
+                if dedupe and self._last.get(key, _UNSET) == value:
+                    self.skipped += 1
+                    continue
+                self._last[key] = value
+
+            # how long it waited to hit the screen
+            METRICS.observe("tk_dispatch", now - posted)
+            try:
+                fn(value)
+            except Exception as e:
+                print(f"UI update '{key}' failed: {e}")
+
+        self.root.after(self.interval_ms, self._tick)
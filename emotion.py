@@ -0,0 +1,180 @@
+import threading
+import time
+
+import cv2
+import numpy as np
+
+# same order deepface uses for the emotion model output
+EMOTIONS = ["angry", "disgust", "fear", "happy", "sad", "surprise", "neutral"]
+
+
+class ModelService:
+    # the lifecycle every emotion backend shares (EmotionService, the tflite one,
+    # InferenceWorker, InferenceClient): load in the background, then answer
+    # analyze / analyze_batch. states: idle -> loading -> ready (or failed)
+    # a backend implements _load() (raise to fail) and predict(faces) -> (n, 7)
+    # percent scores, one row per face
+    name = "Emotion model"
+    install_hint = None     # error to show when _load hits an ImportError
+
+    def __init__(self):
+        self.state = "idle"
+        self.error = None
+        self.load_time = None
+        self._ready = threading.Event()
+        self._lock = threading.Lock()
+
+    @property
+    def ready(self):
+        return self.state == "ready"
+
+    def start(self):
+        # load + warm the model in the background, safe to call more than once
+        with self._lock:
+            if self.state != "idle":
+                return
+            self.state = "loading"
+        threading.Thread(target=self._start, daemon=True).start()
+
+    def _start(self):
+        t0 = time.perf_counter()
+        try:
+            self._load()
+            self.load_time = time.perf_counter() - t0
+            self.state = "ready"
+            print(f"{self.name} ready in {self.load_time:.2f}s")
+        except ImportError as e:
+            self.error = self.install_hint or str(e)
+            self.state = "failed"
+            print(f"ERROR: {self.error}")
+        except Exception as e:
+            self.error = str(e)
+            self.state = "failed"
+            print(f"ERROR loading {self.name.lower()}: {e}")
+        finally:
+            self._ready.set()
+
+    def wait(self, timeout=None):
+        self._ready.wait(timeout)
+        return self.ready
+
+    def stop(self):
+        pass
+
+    def _load(self):
+        raise NotImplementedError
+
+    def predict(self, faces):
+        raise NotImplementedError
+
+    def _check_ready(self, timeout):
+        if not self.wait(timeout):
+            raise RuntimeError(self.error or f"{self.name} not ready")
+
+    def analyze(self, frame, timeout=60):
+        # one whole BGR frame, backends with a face finder override this
+        self._check_ready(timeout)
+        return dict(zip(EMOTIONS, self.predict([frame])[0].tolist()))
+
+    def analyze_batch(self, faces, method="weighted", timeout=60):
+        # faces are BGR crops from the hold-still window, one forward pass for all of them
+        self._check_ready(timeout)
+        if not faces:
+            raise ValueError("No faces to analyze")
+        return dict(zip(EMOTIONS, combine_scores(self.predict(faces), method).tolist()))
+
+
+class EmotionService(ModelService):
+    # keeps the deepface emotion model loaded so scans only pay for the forward pass
+    install_hint = "DeepFace not installed! Run `pip install deepface`"
+
+    def __init__(self):
+        super().__init__()
+        self._deepface = None
+        self._model = None
+
+    def _load(self):
+        from deepface import DeepFace
+        self._deepface = DeepFace
+
+        # run one dummy frame through so the model gets built + cached now
+        # instead of on the first customer
+        blank = np.zeros((224, 224, 3), dtype=np.uint8)
+        self._run(blank)
+
+        self._model = self._build_batch_model()
+        if self._model is not None:
+            self._predict_batch([blank])
+
+    def _run(self, frame):
+        result = self._deepface.analyze(
+            frame,
+            actions=['emotion'],
+            enforce_detection=False,
+            silent=True
+        )
+        if isinstance(result, list):
+            result = result[0]
+        return {k: float(v) for k, v in result['emotion'].items()}
+
+    def _build_batch_model(self):
+        # grab the underlying keras model so several faces go through in one predict
+        # call, build_model's signature moved around between deepface versions
+        for kwargs in ({"task": "facial_attribute", "model_name": "Emotion"}, {"model_name": "Emotion"}):
+            try:
+                client = self._deepface.build_model(**kwargs)
+                return getattr(client, "model", client)
+            except TypeError:
+                continue
+            except Exception as e:
+                print(f"Batch emotion model unavailable, using per-frame analyze: {e}")
+                return None
+        return None
+
+    def _predict_batch(self, faces):
+        return to_percent(self._model.predict(preprocess(faces), verbose=0))
+
+    def analyze(self, frame, timeout=60):
+        # frame is the BGR numpy array straight from the camera, deepface finds the face
+        self._check_ready(timeout)
+        return self._run(frame)
+
+    def predict(self, faces):
+        # (n, 7) percent scores, one row per face, model has to be loaded already
+        if self._model is not None:
+            return self._predict_batch(faces)
+        return np.array([[self._run(f)[e] for e in EMOTIONS] for f in faces])
+
+
+def shrink_face(face, out=None):
+    # BGR / gray crop -> the model's 48x48 gray. everything that feeds the model
+    # goes through here (inference_server.py too) so the same face gets the same pixels
+    gray = cv2.cvtColor(face, cv2.COLOR_BGR2GRAY) if face.ndim == 3 else face
+    return cv2.resize(gray, (48, 48), dst=out)
+
+
+def preprocess(faces):
+    # same preprocessing deepface does: gray, 48x48, scaled to 0..1
+    batch = np.empty((len(faces), 48, 48, 1), dtype=np.float32)
+    for i, face in enumerate(faces):
+        batch[i, :, :, 0] = shrink_face(face)
+    batch /= 255.0
+    return batch
+
+
+def to_percent(probs):
+    # deepface reports each emotion as a percentage of the row total
+    probs = np.asarray(probs, dtype=np.float64)
+    return probs / probs.sum(axis=1, keepdims=True) * 100
+
+
+def combine_scores(scores, method="weighted"):
+    # scores is (n_frames, 7) in percent -> one (7,) vector
+    scores = np.asarray(scores, dtype=np.float64)
+    if method == "mean":
+        return scores.mean(axis=0)
+    if method == "weighted":
+        # frames where the model was more sure of itself count for more
+        weights = scores.max(axis=1)
+        return (weights[:, None] * scores).sum(axis=0) / weights.sum()
+    raise ValueError(f"Unknown combine method: {method}")
@@ -0,0 +1,223 @@
+import argparse
+import os
+import sys
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from emotion import EMOTIONS, ModelService, preprocess, to_percent
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+TFLITE_MODEL = os.path.join(HERE, "models", "emotion_int8.tflite")
+
+# the deepface emotion model as a quantized tflite file, run with the small
+# tflite interpreter instead of full tensorflow (much faster to import, way
+# less ram on the pi). export it once on a machine that has tensorflow:
+#   python emotion_tflite.py export --quant int8 --calib path/to/face/crops
+#   python emotion_tflite.py check models/emotion_int8.tflite --images path/to/face/crops
+# then set EMOTION_BACKEND = "tflite" in main.py. on the pi only
+# `pip install tflite-runtime` (or ai-edge-litert) is needed
+
+
+def _interpreter(path, threads):
+    # smallest runtime that's installed wins, full tensorflow last
+    try:
+        from tflite_runtime.interpreter import Interpreter
+    except ImportError:
+        try:
+            from ai_edge_litert.interpreter import Interpreter
+        except ImportError:
+            from tensorflow.lite import Interpreter
+    return Interpreter(model_path=path, num_threads=threads)
+
+
+class TFLiteEmotionService(ModelService):
+    # drop-in for EmotionService, same states and analyze / analyze_batch
+    name = "TFLite emotion model"
+    install_hint = "No tflite interpreter! Run `pip install tflite-runtime`"
+
+    def __init__(self, path=TFLITE_MODEL, threads=2):
+        super().__init__()
+        self.path = path
+        self.threads = threads
+        self._interp = None
+        self._batch = None      # batch size the input tensor is currently sized for
+        self._face_finder = None
+        self._run_lock = threading.Lock()   # the interpreter isn't thread safe
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            raise FileNotFoundError(
+                f"No tflite model at {self.path}, run `python emotion_tflite.py export` first"
+            )
+        self._interp = _interpreter(self.path, self.threads)
+        self._input = self._interp.get_input_details()[0]
+        self._output = self._interp.get_output_details()[0]
+        self.predict([np.zeros((48, 48), dtype=np.uint8)])
+
+    def predict(self, faces):
+        batch = preprocess(faces)
+        inp, out = self._input, self._output
+
+        # int8 / uint8 models with quantized io want the input scaled onto their grid
+        scale, zero = inp["quantization"]
+        if inp["dtype"] != np.float32:
+            info = np.iinfo(inp["dtype"])
+            batch = np.clip(np.round(batch / scale + zero), info.min, info.max).astype(inp["dtype"])
+
+        with self._run_lock:
+            # only reallocate when the number of faces changes
+            if self._batch != len(faces):
+                self._interp.resize_tensor_input(inp["index"], batch.shape)
+                self._interp.allocate_tensors()
+                self._batch = len(faces)
+            self._interp.set_tensor(inp["index"], batch)
+            self._interp.invoke()
+            probs = self._interp.get_tensor(out["index"])
+
+        scale, zero = out["quantization"]
+        if out["dtype"] != np.float32:
+            probs = (probs.astype(np.float32) - zero) * scale
+        return to_percent(probs)
+
+    def _crop_face(self, frame):
+        # deepface.analyze finds the face itself, here we use the haar cascade
+        # and fall back to the whole frame like enforce_detection=False does
+        if self._face_finder is None:
+            from detector import make_detector
+            self._face_finder = make_detector("haar")
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+        faces = self._face_finder.detect(gray)
+        if not faces:
+            return frame
+        x, y, w, h = max(faces, key=lambda f: f[2] * f[3])
+        return frame[y:y + h, x:x + w]
+
+    def analyze(self, frame, timeout=60):
+        self._check_ready(timeout)
+        scores = self.predict([self._crop_face(frame)])[0]
+        return dict(zip(EMOTIONS, scores.tolist()))
+
+
+def load_faces(folder, limit=None):
+    # every image in the folder, cropped to its biggest face if haar finds one
+    from detector import make_detector
+
+    finder = make_detector("haar")
+    faces = []
+    for name in sorted(os.listdir(folder)):
+        img = cv2.imread(os.path.join(folder, name))
+        if img is None:
+            continue
+        boxes = finder.detect(cv2.cvtColor(img, cv2.COLOR_BGR2GRAY))
+        if boxes:
+            x, y, w, h = max(boxes, key=lambda f: f[2] * f[3])
+            img = img[y:y + h, x:x + w]
+        faces.append(img)
+        if limit and len(faces) >= limit:
+            break
+    if not faces:
+        raise SystemExit(f"No images found in {folder}")
+    return faces
+
+
+def export(out_path, quant="int8", calib=None, calib_limit=200):
+    # needs full tensorflow + deepface, only run this on the dev machine
+    import tensorflow as tf
+    from emotion import EmotionService
+
+    service = EmotionService()
+    service.start()
+    if not service.wait() or service._model is None:
+        raise SystemExit(f"Couldn't load the deepface emotion model: {service.error}")
+
+    converter = tf.lite.TFLiteConverter.from_keras_model(service._model)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if quant == "float16":
+        converter.target_spec.supported_types = [tf.float16]
+    elif quant == "int8":
+        if not calib:
+            raise SystemExit("int8 needs --calib, a folder of face images to calibrate on")
+        batch = preprocess(load_faces(calib, calib_limit))
+
+        def representative():
+            for i in range(len(batch)):
+                yield [batch[i:i + 1]]
+
+        converter.representative_dataset = representative
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+    elif quant != "dynamic":
+        raise SystemExit(f"Unknown quantization '{quant}'")
+
+    data = converter.convert()
+    os.makedirs(os.path.dirname(out_path) or ".", exist_ok=True)
+    with open(out_path, "wb") as f:
+        f.write(data)
+    print(f"wrote {out_path} ({len(data) / 1024:.0f} KiB, {quant})")
+
+
+def check(path, images, max_diff=10.0, min_agree=0.95, limit=None):
+    # full keras model vs the tflite file on the same crops, exit 1 if it drifted
+    from emotion import EmotionService
+
+    faces = load_faces(images, limit)
+
+    full = EmotionService()
+    full.start()
+    if not full.wait() or full._model is None:
+        raise SystemExit(f"Couldn't load the deepface emotion model: {full.error}")
+    lite = TFLiteEmotionService(path)
+    lite.start()
+    if not lite.wait():
+        raise SystemExit(lite.error)
+
+    t0 = time.perf_counter()
+    ref = np.concatenate([full._predict_batch([f]) for f in faces])
+    t_full = (time.perf_counter() - t0) / len(faces)
+    t0 = time.perf_counter()
+    got = np.concatenate([lite.predict([f]) for f in faces])
+    t_lite = (time.perf_counter() - t0) / len(faces)
+
+    diff = np.abs(ref - got)
+    agree = float((ref.argmax(axis=1) == got.argmax(axis=1)).mean())
+    print(f"  {len(faces)} faces from {images}")
+    print(f"  top-1 agreement   {agree * 100:6.1f}%   (need >= {min_agree * 100:.0f}%)")
+    print(f"  max abs diff      {diff.max():6.2f} pts (need <= {max_diff:.1f})")
+    print(f"  mean abs diff     {diff.mean():6.2f} pts")
+    for i, e in enumerate(EMOTIONS):
+        print(f"    {e:<9} {diff[:, i].mean():6.2f} mean  {diff[:, i].max():6.2f} max")
+    print(f"  ms/face           {t_full * 1000:6.2f} keras  {t_lite * 1000:6.2f} tflite")
+
+    ok = agree >= min_agree and diff.max() <= max_diff
+    print("  OK" if ok else "  FAILED, tflite model is outside tolerance")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export / check the quantized tflite emotion model")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+
+    p = sub.add_parser("export", help="convert the deepface emotion model to tflite")
+    p.add_argument("--out", default=TFLITE_MODEL)
+    p.add_argument("--quant", default="int8", choices=["int8", "float16", "dynamic"])
+    p.add_argument("--calib", help="folder of face images for int8 calibration")
+    p.add_argument("--calib-limit", type=int, default=200)
+
+    p = sub.add_parser("check", help="compare the tflite model against the full one")
+    p.add_argument("model", nargs="?", default=TFLITE_MODEL)
+    p.add_argument("--images", required=True, help="folder of face images")
+    p.add_argument("--max-diff", type=float, default=10.0, help="max per-emotion diff in percent points")
+    p.add_argument("--min-agree", type=float, default=0.95, help="min top-1 agreement, 0..1")
+    p.add_argument("--limit", type=int)
+
+    args = parser.parse_args()
+    if args.cmd == "export":
+        export(args.out, args.quant, args.calib, args.calib_limit)
+    else:
+        sys.exit(0 if check(args.model, args.images, args.max_diff, args.min_agree, args.limit) else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,202 @@
+import os
+import select
+import threading
+import time
+import tty
+
+import protocol
+
+# stand-in for the arduino on a pty, speaks the same line protocol as
+# arduino_link.py (or the binary frames in protocol.py with framed=True, or
+# the old unsequenced sketch with legacy=True) so the real host code can run
+# with no board plugged in
+
+
+class FakeArduino:
+    def __init__(self, time_scale=1.0, ack_delay=0.005, fail=(), framed=False, nak_first=0, legacy=False,
+                 corrupt_replies=0, bad_length_replies=0):
+        self.time_scale = time_scale    # 0.1 = pour 10x faster than real life
+        self.ack_delay = ack_delay
+        self.fail = set(fail)           # commands that should answer ERR
+        self.framed = framed
+        self.legacy = legacy            # bare command lines in, never a reply
+        self.nak_first = nak_first      # pretend the first n frames had a bad crc
+        self.corrupt_replies = corrupt_replies  # garble the crc of the next n ACK / DONE frames
+        self.bad_length_replies = bad_length_replies    # garble the length of the next n ACKs
+        self._last_sent = {}            # seq -> last frame sent for it, resent on a NAK
+        self._seen = set()              # seqs already run, a resend of one isn't run twice
+        self.received = []
+        self._cancel = threading.Event()
+        self._master = None
+        self._slave = None
+        self._running = False
+        self.port = None
+
+    def start(self):
+        self._master, self._slave = os.openpty()
+        tty.setraw(self._slave)
+        self.port = os.ttyname(self._slave)
+        self._running = True
+        loop = self._frame_loop if self.framed else self._loop
+        threading.Thread(target=loop, name="fake-arduino", daemon=True).start()
+        return self
+
+    def stop(self):
+        self._running = False
+        for fd in (self._master, self._slave):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+
+    def _send(self, line):
+        os.write(self._master, (line + "\n").encode('utf-8'))
+
+    def _loop(self):
+        buf = b""
+        while self._running:
+            try:
+                chunk = os.read(self._master, 256)
+            except OSError:
+                break
+            buf += chunk
+            while b"\n" in buf:
+                line, buf = buf.split(b"\n", 1)
+                line = line.decode('utf-8', errors='replace').strip()
+                if line:
+                    # answer on another thread so a long pour doesn't block reading
+                    threading.Thread(target=self._handle, args=(line,), daemon=True).start()
+
+    def _frame_loop(self):
+        decoder = protocol.Decoder()
+        while self._running:
+            try:
+                ready, _, _ = select.select([self._master], [], [], 0.05)
+                chunk = os.read(self._master, 256) if ready else b""
+            except (OSError, ValueError):
+                break
+            lost = decoder.lost
+            # quiet line with half a frame buffered, like the sketch's inter-byte timeout
+            frames = decoder.feed(chunk) if chunk else decoder.flush()
+            if decoder.lost != lost:
+                # can't trust anything in that frame, seq 0 = resend whatever I haven't ACKed
+                self._send_frame(protocol.NAK, 0)
+            for frame in frames:
+                if frame.type == protocol.NAK:
+                    # the host couldn't read one of ours, send it again (like the sketch)
+                    data = self._last_sent.get(frame.seq)
+                    if data:
+                        os.write(self._master, data)
+                    continue
+                if self.nak_first > 0:
+                    self.nak_first -= 1
+                    self._send_frame(protocol.NAK, 0)
+                    continue
+                if frame.seq in self._seen:
+                    # a resend of something already running / run, just answer again
+                    data = self._last_sent.get(frame.seq)
+                    if data:
+                        os.write(self._master, data)
+                    continue
+                self._seen.add(frame.seq)
+                if frame.type == protocol.CANCEL:
+                    # handled right here so it can interrupt a pour in progress
+                    self._cancel.set()
+                    self._send_frame(protocol.DONE, frame.seq)
+                    continue
+                threading.Thread(target=self._handle_frame, args=(frame,), daemon=True).start()
+
+    def _send_frame(self, msg_type, seq, payload=b""):
+        data = protocol.encode(msg_type, seq, payload)
+        if msg_type != protocol.NAK:
+            self._last_sent[seq] = data
+        if self.corrupt_replies > 0 and msg_type in (protocol.ACK, protocol.DONE):
+            self.corrupt_replies -= 1
+            data = data[:-1] + bytes([data[-1] ^ 0xFF])
+        elif self.bad_length_replies > 0 and msg_type == protocol.ACK:
+            self.bad_length_replies -= 1
+            data = data[:1] + bytes([200]) + data[2:]
+        os.write(self._master, data)
+
+    def _handle_frame(self, frame):
+        name = protocol.NAMES.get(frame.type, str(frame.type))
+        text = frame.payload.decode('utf-8', errors='replace') if frame.type == protocol.TEXT else name
+        self.received.append(text)
+
+        time.sleep(self.ack_delay)
+        if frame.type == protocol.PING:
+            self._send_frame(protocol.DONE, frame.seq)
+            return
+        if text in self.fail or name in self.fail:
+            self._send_frame(protocol.ERR, frame.seq, f"{text} failed".encode('utf-8'))
+            return
+        if frame.type == protocol.TIMELINE:
+            try:
+                events = protocol.decode_timeline(frame.payload)
+            except protocol.ProtocolError as e:
+                self._send_frame(protocol.ERR, frame.seq, str(e).encode('utf-8'))
+                return
+            self._send_frame(protocol.ACK, frame.seq)
+            if not self._play(frame.seq, events):
+                self._send_frame(protocol.ERR, frame.seq, b"cancelled")
+                return
+        elif frame.type == protocol.TEXT:
+            self._send_frame(protocol.ACK, frame.seq)
+        else:
+            self._send_frame(protocol.ERR, frame.seq, f"unknown frame type {name}".encode('utf-8'))
+            return
+        self._send_frame(protocol.DONE, frame.seq)
+
+    def _play(self, seq, events):
+        # like the sketch: walk the uploaded events on the clock, PROGRESS for each
+        self._cancel.clear()
+        t0 = time.monotonic()
+        for i, (at, pump, on) in enumerate(events):
+            wait = t0 + at * self.time_scale - time.monotonic()
+            if wait > 0 and self._cancel.wait(wait):
+                return False
+            if self._cancel.is_set():
+                return False
+            payload = protocol.encode_progress(i, len(events), pump, on, time.monotonic() - t0)
+            self._send_frame(protocol.PROGRESS_MSG, seq, payload)
+        return True
+
+    def _handle(self, line):
+        if self.legacy:
+            self.received.append(line)
+            return
+
+        seq, _, cmd = line.partition(" ")
+        self.received.append(cmd)
+
+        time.sleep(self.ack_delay)
+        if cmd in self.fail:
+            self._send(f"ERR {seq} {cmd} failed")
+            return
+        self._send(f"ACK {seq}")
+
+        words = cmd.split()
+        if words and words[0].upper() == "DISPENSE" and len(words) > 1:
+            from recipes import get_timeline
+
+            timeline = get_timeline(words[1])
+            t0 = time.monotonic()
+            for at, pump, on in timeline.events:
+                wait = t0 + at * self.time_scale - time.monotonic()
+                if wait > 0:
+                    time.sleep(wait)
+                if on:
+                    self._send(f"PROGRESS {seq} Dispensing: Pump {pump}")
+        self._send(f"DONE {seq}")
+
+
+if __name__ == "__main__":
+    # run a fake board for arduino_test.py / main.py to talk to
+    import sys
+    fake = FakeArduino(framed="--framed" in sys.argv).start()
+    print(f"Fake Arduino on {fake.port}{' (framed)' if fake.framed else ''} (ctrl-c to stop)")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        fake.stop()
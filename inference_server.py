@@ -0,0 +1,415 @@
+import argparse
+import itertools
+import os
+import queue
+import socket
+import struct
+import subprocess
+import sys
+import threading
+import time
+
+import numpy as np
+
+from emotion import EMOTIONS, ModelService, shrink_face
+
+# one emotion model for every kiosk at the venue. kiosks send their face crops
+# over a unix or tcp socket, requests that land within window_ms of each other
+# go through the model as one batch
+#   python inference_server.py serve --address unix:/tmp/moodmixer.sock
+#   python inference_server.py serve --address tcp:0.0.0.0:9200 --backend tflite
+#   python inference_server.py load --address unix:/tmp/moodmixer.sock --spawn --clients 8
+# kiosks point INFERENCE_SERVER in main.py at it and fall back to their own
+# model if it's unreachable
+#
+# every message is u32 body length + body, little endian
+#   request   id u32 | n u8 | n x 48x48 gray u8 crops
+#   response  id u32 | status u8 | batch_faces u16 | n x 7 f32 percent (status 0)
+#                                                  | utf-8 error        (status 1)
+# crops are shrunk to the model's 48x48 gray on the kiosk, so a request is ~2KB a face.
+# the kiosk combines the per-face scores itself, same as with a local model
+
+FACE = 48
+LENGTH = struct.Struct("<I")
+REQUEST = struct.Struct("<IB")
+RESPONSE = struct.Struct("<IBH")
+SCORES = np.dtype("<f4")
+MAX_FACES = 255
+
+
+def parse_address(address):
+    # "unix:/path", "tcp:host:port" or plain "host:port"
+    if address.startswith("unix:"):
+        return socket.AF_UNIX, address[5:]
+    if address.startswith("tcp:"):
+        address = address[4:]
+    host, _, port = address.rpartition(":")
+    return socket.AF_INET, (host or "127.0.0.1", int(port))
+
+
+def _recv_exact(sock, n):
+    buf = bytearray(n)
+    view = memoryview(buf)
+    got = 0
+    while got < n:
+        k = sock.recv_into(view[got:])
+        if not k:
+            raise ConnectionError("connection closed")
+        got += k
+    return buf
+
+
+def _recv_message(sock):
+    (length,) = LENGTH.unpack(_recv_exact(sock, LENGTH.size))
+    return _recv_exact(sock, length)
+
+
+def _send_message(sock, body):
+    sock.sendall(LENGTH.pack(len(body)) + body)
+
+
+def pack_faces(faces):
+    # BGR / gray crops -> the model's input size, as one contiguous block. same
+    # resize as the local model's preprocess, so server and fallback agree
+    out = np.empty((len(faces), FACE, FACE), dtype=np.uint8)
+    for i, face in enumerate(faces):
+        shrink_face(face, out[i])
+    return out
+
+
+class _Request:
+    def __init__(self, conn, write_lock, req_id, faces):
+        self.conn = conn
+        self.write_lock = write_lock
+        self.id = req_id
+        self.faces = faces
+        self.received = time.perf_counter()
+
+    def reply(self, status, batch_faces, payload):
+        try:
+            with self.write_lock:
+                _send_message(self.conn, RESPONSE.pack(self.id, status, batch_faces) + payload)
+        except OSError:
+            pass    # kiosk went away, nothing to do
+
+
+class InferenceServer:
+    def __init__(self, service, address, window=0.01, max_faces=64):
+        self.service = service          # anything with predict(faces) -> (n, 7), e.g. EmotionService
+        self.address = address
+        self.window = window            # how long the first request waits for company
+        self.max_faces = max_faces      # forward pass size cap
+        self.requests = 0
+        self.batches = 0
+        self.faces = 0
+        self._queue = queue.Queue()
+        self._sock = None
+        self._running = False
+
+    def serve_forever(self):
+        family, addr = parse_address(self.address)
+        if family == socket.AF_UNIX and os.path.exists(addr):
+            os.unlink(addr)     # stale socket from a previous run
+        self._sock = socket.socket(family, socket.SOCK_STREAM)
+        if family == socket.AF_INET:
+            self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._sock.bind(addr)
+        self._sock.listen()
+        self._running = True
+        threading.Thread(target=self._batcher, name="batcher", daemon=True).start()
+        print(f"Inference server on {self.address}, window {self.window * 1000:.0f}ms, "
+              f"max {self.max_faces} faces a batch")
+
+        try:
+            while self._running:
+                try:
+                    conn, _ = self._sock.accept()
+                except OSError:
+                    break
+                threading.Thread(target=self._client, args=(conn,), daemon=True).start()
+        finally:
+            self.stop()
+
+    def stop(self):
+        self._running = False
+        self._queue.put(None)
+        if self._sock:
+            self._sock.close()
+            self._sock = None
+            family, addr = parse_address(self.address)
+            if family == socket.AF_UNIX and os.path.exists(addr):
+                os.unlink(addr)
+
+    def _client(self, conn):
+        # one thread per kiosk connection, just parses and queues
+        if conn.family == socket.AF_INET:
+            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        write_lock = threading.Lock()
+        try:
+            while self._running:
+                body = _recv_message(conn)
+                req_id, n = REQUEST.unpack_from(body)
+                faces = np.frombuffer(body, np.uint8, n * FACE * FACE, REQUEST.size).reshape(n, FACE, FACE)
+                req = _Request(conn, write_lock, req_id, faces)
+                if not n:
+                    req.reply(1, 0, b"bad request")
+                    continue
+                self._queue.put(req)
+        except (OSError, ValueError, struct.error):
+            pass    # disconnected or sent garbage, drop it
+        finally:
+            conn.close()
+
+    def _batcher(self):
+        while self._running:
+            first = self._queue.get()
+            if first is None:
+                break
+
+            # everything that shows up within the window rides along
+            batch, n = [first], len(first.faces)
+            deadline = first.received + self.window
+            while n < self.max_faces:
+                try:
+                    req = self._queue.get(timeout=max(deadline - time.perf_counter(), 0))
+                except queue.Empty:
+                    break
+                if req is None:
+                    self._running = False
+                    break
+                batch.append(req)
+                n += len(req.faces)
+
+            try:
+                scores = self.service.predict(np.concatenate([r.faces for r in batch]))
+            except Exception as e:
+                for r in batch:
+                    r.reply(1, n, str(e).encode('utf-8'))
+                continue
+
+            self.batches += 1
+            self.requests += len(batch)
+            self.faces += n
+            start = 0
+            for r in batch:
+                rows = scores[start:start + len(r.faces)]
+                start += len(r.faces)
+                r.reply(0, n, rows.astype(SCORES).tobytes())
+
+    def summary(self):
+        if not self.batches:
+            return "no requests"
+        return (f"{self.requests} requests, {self.faces} faces in {self.batches} batches "
+                f"({self.faces / self.batches:.1f} faces a batch)")
+
+
+class InferenceClient(ModelService):
+    # same interface as EmotionService, but the model lives in the inference
+    # server. fallback() builds a local service if the server can't be reached,
+    # only called the first time it's needed so tensorflow stays unloaded otherwise
+    name = "Inference server"
+
+    def __init__(self, address, fallback=None, connect_timeout=5.0, read_timeout=30.0, retry_after=10.0):
+        super().__init__()
+        self.address = address
+        self.fallback = fallback
+        self.connect_timeout = connect_timeout
+        # a busy server is still quicker than loading the model here mid-scan,
+        # so replies get a lot longer than the connect does
+        self.read_timeout = read_timeout
+        self.retry_after = retry_after      # secs before trying the server again
+        self.last_batch = None              # faces in the server batch our last request was in
+        self.local = None
+        self._sock = None
+        self._failed_at = None
+        self._ids = itertools.count(1)
+
+    def _load(self):
+        if self._connect():
+            print(f"Using inference server {self.address}")
+        elif not self._start_local():
+            raise RuntimeError(self.error or "Inference server not available")
+
+    def _connect(self):
+        family, addr = parse_address(self.address)
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        sock.settimeout(self.connect_timeout)
+        try:
+            sock.connect(addr)
+        except OSError as e:
+            sock.close()
+            self._failed_at = time.monotonic()
+            self.error = f"Inference server {self.address} unreachable: {e}"
+            print(self.error)
+            return False
+        if family == socket.AF_INET:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.settimeout(self.read_timeout)
+        self._sock = sock
+        self._failed_at = None
+        return True
+
+    def _start_local(self):
+        if self.fallback is None:
+            return False
+        if self.local is None:
+            print("Falling back to the local emotion model")
+            self.local = self.fallback()
+            self.local.start()
+        if not self.local.wait():
+            self.error = self.local.error
+            return False
+        return True
+
+    def predict(self, faces):
+        # (n, 7) scores for the last MAX_FACES faces, from the server or the fallback
+        faces = faces[-MAX_FACES:]
+        with self._lock:
+            if self._sock is None and self._failed_at is not None \
+                    and time.monotonic() - self._failed_at > self.retry_after:
+                self._connect()
+            if self._sock is not None:
+                try:
+                    return self._request(faces)
+                except (OSError, ConnectionError, struct.error) as e:
+                    print(f"Inference server request failed: {e}")
+                    self._sock.close()
+                    self._sock = None
+                    self._failed_at = time.monotonic()
+
+        if not self._start_local():
+            raise RuntimeError(self.error or "Inference server not available")
+        return self.local.predict(faces)
+
+    def _request(self, faces):
+        req_id = next(self._ids) & 0xFFFFFFFF
+        _send_message(self._sock, REQUEST.pack(req_id, len(faces)) + pack_faces(faces).tobytes())
+        body = _recv_message(self._sock)
+        got_id, status, batch_faces = RESPONSE.unpack_from(body)
+        if got_id != req_id:
+            raise ConnectionError(f"reply for request {got_id}, expected {req_id}")
+        payload = bytes(body[RESPONSE.size:])
+        if status:
+            # the server is up but the model said no, no point falling back
+            raise RuntimeError(payload.decode('utf-8', errors='replace'))
+        scores = np.frombuffer(payload, SCORES)
+        if scores.size != len(faces) * len(EMOTIONS):
+            raise ConnectionError(f"{scores.size} scores back for {len(faces)} faces")
+        self.last_batch = batch_faces
+        return scores.reshape(len(faces), len(EMOTIONS)).astype(np.float64)
+
+    def stop(self):
+        with self._lock:
+            if self._sock is not None:
+                self._sock.close()
+                self._sock = None
+        if self.local:
+            self.local.stop()
+
+
+def make_service(backend):
+    if backend == "tflite":
+        from emotion_tflite import TFLiteEmotionService
+        return TFLiteEmotionService()
+    from emotion import EmotionService
+    return EmotionService()
+
+
+def serve(args):
+    service = make_service(args.backend)
+    service.start()
+    if not service.wait():
+        raise SystemExit(f"Emotion model failed to load: {service.error}")
+    server = InferenceServer(service, args.address, args.window_ms / 1000, args.max_faces)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+        print(server.summary())
+
+
+def load(args):
+    # n kiosks hammering the server at once, each with its own connection
+    proc = None
+    if args.spawn:
+        proc = subprocess.Popen([
+            sys.executable, os.path.abspath(__file__), "serve", "--address", args.address,
+            "--backend", args.backend, "--window-ms", str(args.window_ms),
+        ])
+
+    clients = []
+    deadline = time.monotonic() + 300
+    for _ in range(args.clients):
+        while True:
+            client = InferenceClient(args.address, connect_timeout=2.0)
+            client.start()
+            if client.wait() or time.monotonic() > deadline or (proc and proc.poll() is not None):
+                break
+            time.sleep(0.5)     # server still loading its model
+        if not client.ready:
+            if proc:
+                proc.terminate()
+            raise SystemExit(client.error)
+        clients.append(client)
+
+    rng = np.random.default_rng(0)
+    faces = [rng.integers(0, 255, (120, 120, 3), dtype=np.uint8) for _ in range(args.faces)]
+    latencies, batches = [], []
+    lock = threading.Lock()
+
+    def run(client):
+        for _ in range(args.requests):
+            t0 = time.perf_counter()
+            client.analyze_batch(faces)
+            with lock:
+                latencies.append(time.perf_counter() - t0)
+                batches.append(client.last_batch)
+
+    t0 = time.perf_counter()
+    threads = [threading.Thread(target=run, args=(c,)) for c in clients]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - t0
+
+    for c in clients:
+        c.stop()
+    if proc:
+        proc.terminate()
+        proc.wait()
+
+    ms = np.asarray(latencies) * 1000
+    print(f"\n  {args.clients} clients x {args.requests} requests x {args.faces} faces in {elapsed:.1f}s")
+    print(f"  {len(latencies) / elapsed:8.1f} requests/s  {len(latencies) * args.faces / elapsed:8.1f} faces/s")
+    print(f"  latency  p50 {np.percentile(ms, 50):.1f}  p90 {np.percentile(ms, 90):.1f}  "
+          f"p99 {np.percentile(ms, 99):.1f}  max {ms.max():.1f} ms")
+    print(f"  server batches averaged {np.mean(batches):.1f} faces")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Shared emotion inference server for several kiosks")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    for name in ("serve", "load"):
+        p = sub.add_parser(name)
+        p.add_argument("--address", default="unix:/tmp/moodmixer.sock", help="unix:/path or tcp:host:port")
+        p.add_argument("--backend", default="keras", choices=["keras", "tflite"])
+        p.add_argument("--window-ms", type=float, default=10, help="batching window")
+        if name == "serve":
+            p.add_argument("--max-faces", type=int, default=64)
+        else:
+            p.add_argument("--spawn", action="store_true", help="start a server for the run")
+            p.add_argument("--clients", type=int, default=4)
+            p.add_argument("--requests", type=int, default=50, help="per client")
+            p.add_argument("--faces", type=int, default=8, help="crops per request")
+    args = parser.parse_args()
+    if args.cmd == "serve":
+        serve(args)
+    else:
+        load(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,218 @@
+import itertools
+import multiprocessing as mp
+import queue
+import threading
+import time
+from multiprocessing import shared_memory
+
+import cv2
+import numpy as np
+
+from emotion import EmotionService, ModelService
+
+FACE_SIZE = 112   # crops get resized to this before going into shared memory
+MAX_RESTARTS = 5        # crashes in a row before we stop respawning the child
+RESTART_BACKOFF = 1.0   # seconds before the first respawn, doubles every crash in a row
+MAX_BACKOFF = 30.0
+
+
+def _worker_main(shm_name, shape, jobs, results):
+    # runs in the child process, tensorflow only ever lives here
+    shm = shared_memory.SharedMemory(name=shm_name)
+    faces = np.ndarray(shape, dtype=np.uint8, buffer=shm.buf)
+
+    service = EmotionService()
+    service.start()
+    if not service.wait():
+        results.put(("failed", None, service.error))
+        shm.close()
+        return
+    results.put(("ready", None, service.load_time))
+
+    while True:
+        job = jobs.get()
+        if job is None:
+            break
+
+        job_id, n = job
+        try:
+            # (n, 7) scores back, the kiosk side combines them like every backend
+            results.put(("result", job_id, service.predict([faces[i] for i in range(n)])))
+        except Exception as e:
+            results.put(("error", job_id, str(e)))
+
+    shm.close()
+
+
+class _Job:
+    def __init__(self, job_id):
+        self.id = job_id
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class InferenceWorker(ModelService):
+    # same interface as EmotionService, but the model runs in its own process so
+    # tensorflow never fights the tk/preview threads for the gil
+    # frames go over shared memory, only tiny job tuples get pickled
+    name = "Inference worker"
+
+    def __init__(self, max_batch=8, face_size=FACE_SIZE, max_restarts=MAX_RESTARTS, job_timeout=60):
+        super().__init__()
+        self.max_batch = max_batch
+        self.face_size = face_size
+        self.max_restarts = max_restarts
+        self.job_timeout = job_timeout  # secs the child gets to answer one batch
+        self.restarts = 0
+        self._crashes = 0       # in a row, reset by the first good result
+
+        self._ctx = mp.get_context("spawn")
+        self._shape = (max_batch, face_size, face_size, 3)
+        self._shm = None
+        self._faces = None
+        self._proc = None
+        self._jobs = None
+        self._results = None
+        self._ids = itertools.count()
+        self._job = None        # owns shared memory until the child has answered it
+        self._job_lock = threading.Lock()   # one batch in shared memory at a time
+        self._closed = False
+
+    def _load(self):
+        size = int(np.prod(self._shape))
+        self._shm = shared_memory.SharedMemory(create=True, size=size)
+        self._faces = np.ndarray(self._shape, dtype=np.uint8, buffer=self._shm.buf)
+
+        # the listener flips us to ready (or failed) once the child has its model,
+        # and again after every restart
+        self._spawn()
+        threading.Thread(target=self._listen, daemon=True).start()
+        self._ready.wait()
+        if self.state != "ready":
+            raise RuntimeError(self.error or "Inference worker failed to start")
+
+    def _spawn(self):
+        # fresh queues each time, a crashed child can leave the old ones in a bad state
+        self._jobs = self._ctx.Queue()
+        self._results = self._ctx.Queue()
+        self._proc = self._ctx.Process(
+            target=_worker_main,
+            args=(self._shm.name, self._shape, self._jobs, self._results),
+            daemon=True
+        )
+        self.state = "loading"
+        self._ready.clear()
+        self._proc.start()
+
+    def _listen(self):
+        # background thread: hands results back to whoever is waiting, restarts the child if it dies
+        while not self._closed:
+            try:
+                kind, job_id, payload = self._results.get(timeout=0.5)
+            except queue.Empty:
+                if not self._closed and not self._proc.is_alive() and not self._restart():
+                    return
+                continue
+            except (EOFError, OSError) as e:
+                # the pipe to the child is gone, nothing more will come through it
+                if not self._closed:
+                    self._give_up(f"Inference worker pipe broke: {e}")
+                return
+
+            if kind == "ready":
+                self.load_time = payload
+                self.state = "ready"
+                self._ready.set()
+            elif kind == "failed":
+                # model can't load at all, restarting won't help
+                self.error = payload
+                self.state = "failed"
+                self._ready.set()
+                return
+            elif kind == "result":
+                self._crashes = 0
+                self._finish_job(job_id, result=payload)
+            elif kind == "error":
+                self._finish_job(job_id, error=payload)
+
+    def _restart(self):
+        # respawn the child with a growing delay so a model that keeps crashing
+        # doesn't turn into a spawn loop, give up after max_restarts in a row
+        self._crashes += 1
+        print(f"Inference worker died (exit code {self._proc.exitcode})")
+
+        # not ready before failing the job so nobody queues onto the dead child
+        self.state = "loading"
+        self._ready.clear()
+        self._finish_job(None, error="Inference worker crashed")
+
+        if self._crashes > self.max_restarts:
+            self._give_up(f"Inference worker crashed {self._crashes} times in a row")
+            return False
+        delay = min(RESTART_BACKOFF * 2 ** (self._crashes - 1), MAX_BACKOFF)
+        print(f"Restarting inference worker in {delay:.1f}s")
+        time.sleep(delay)
+        if self._closed:
+            return False
+        self.restarts += 1
+        self._spawn()
+        return True
+
+    def _give_up(self, error):
+        print(f"ERROR: {error}")
+        self.error = error
+        self.state = "failed"
+        self._ready.set()
+        self._finish_job(None, error=error)
+
+    def _finish_job(self, job_id, result=None, error=None):
+        job = self._job
+        if job is None or (job_id is not None and job.id != job_id):
+            return
+        job.result = result
+        job.error = error
+        job.done.set()
+
+    def predict(self, faces):
+        # (n, 7) scores for the last max_batch faces, computed in the child
+        with self._job_lock:
+            # the last batch timed out, the child may still be reading it out of
+            # shared memory. wait for its answer, or kill the child (the listener
+            # restarts it) before writing over it
+            stale = self._job
+            if stale is not None and not stale.done.wait(self.job_timeout):
+                print("Inference worker stuck on an old batch, killing it")
+                self._proc.terminate()
+                stale.done.wait(5)
+                raise RuntimeError("Inference worker hung, restarting it")
+            self._job = None
+
+            faces = faces[-self.max_batch:]
+            for i, face in enumerate(faces):
+                cv2.resize(face, (self.face_size, self.face_size), dst=self._faces[i])
+
+            job = _Job(next(self._ids))
+            self._job = job
+            self._jobs.put((job.id, len(faces)))
+
+            if not job.done.wait(self.job_timeout):
+                # stays in self._job, see above
+                raise TimeoutError("Inference worker timed out")
+            self._job = None
+
+            if job.error:
+                raise RuntimeError(job.error)
+            return job.result
+
+    def stop(self):
+        self._closed = True
+        if self._proc and self._proc.is_alive():
+            self._jobs.put(None)
+            self._proc.join(2)
+            if self._proc.is_alive():
+                self._proc.terminate()
+        if self._shm:
+            self._shm.close()
+            self._shm.unlink()
+            self._shm = None
@@ -0,0 +1,117 @@
+import time
+
+from metrics import METRICS
+
+# the scan -> mood -> drink steps of the kiosk, with no tk in them. main.py's
+# FaceScannerApp calls these from its screens and threads, and bench.py drives
+# the very same functions with stand-in hardware, so a change in here shows up
+# in the benchmark numbers too. heavy modules get imported where they're used
+
+
+def scan_step(tracker, hold, frame, now, power=None):
+    # one frame of the scan screen's detect stage: find / track the face, let
+    # the power governor see it and feed the hold-still gate
+    # returns (searching / holding / captured, power state or None)
+    faces = tracker.detect(frame)
+    power_state = power.update(bool(faces)) if power else None
+    state = hold.update(frame, tracker.last_box if faces else None, now)
+    return state, power_state
+
+
+def scan_feedback(state, power_state=None):
+    # what the scan screen shows for a scan_step result -> (ring color, status)
+    from overlay import RING_GREEN, RING_RED
+
+    if state == "holding":
+        return RING_GREEN, "Hold still..."
+    if power_state == "idle":
+        return RING_RED, "Step up to the camera"
+    return RING_RED, "Searching for face..."
+
+
+def take_crops(hold, now, session=None):
+    # the crops from the hold-still window, once scan_step said captured
+    if session:
+        session.timings["scan"] = now - hold.start
+    return list(hold.faces)
+
+
+def analyze_faces(emotion, faces, session=None):
+    # one batched forward pass over every crop -> (DOMINANT, emotions dict)
+    t0 = time.perf_counter()
+    with METRICS.time("inference"):
+        emotions = emotion.analyze_batch(faces)
+    infer_secs = time.perf_counter() - t0
+
+    # full breakdown goes to the session log, stdout just gets the verdict
+    dominant = max(emotions, key=emotions.get).upper()
+    print(f"Mood: {dominant} ({emotions[dominant.lower()]:.0f}%, {len(faces)} frames)")
+    if session:
+        session.emotions = emotions
+        session.dominant = dominant
+        session.frames = len(faces)
+        session.timings["infer"] = infer_secs
+        session.shown = time.time()
+    return dominant, emotions
+
+
+def can_blend(dispenser, protocol):
+    # the line protocols can only name one of the arduino's own recipes
+    return dispenser == "gpio" or protocol == "framed"
+
+
+def choose_timeline(dominant, emotions=None, blend_drinks=True, blendable=True, session=None):
+    # timelines were compiled at startup, a blend gets compiled here
+    from recipes import blend, get_timeline
+
+    dominant = dominant.upper()
+    if blend_drinks and blendable and emotions:
+        timeline = blend(emotions)
+    else:
+        timeline = get_timeline(dominant)
+
+    if session:
+        session.chosen = dominant
+        session.drink = timeline.name
+        session.timings["decide"] = time.time() - (session.shown or session.started)
+    return timeline
+
+
+def dispense(mood, timeline, status, cancel=None, dispenser="arduino", link=None, protocol="legacy",
+             ack_timeout=2.0, done_timeout=60.0):
+    # blocks until the drink is poured, raises if it wasn't
+    # status(text) gets progress for the screen, cancel = threading.Event stops
+    # the pumps mid recipe (gpio / framed). link is an arduino_link LINKS[protocol]
+    if dispenser == "gpio":
+        import pumps
+        with METRICS.time("pump_runtime"):
+            ok = pumps.run_timeline(timeline, status, cancel)
+        if not ok:
+            raise RuntimeError("dispense cancelled")
+        return None
+
+    if link is None:
+        raise RuntimeError("Arduino not connected")
+    status("sending command to Arduino")
+
+    def on_event(kind, text):
+        # screen follows what the arduino actually reports
+        if kind == "ACK":
+            status("dispensing...")
+        elif kind == "PROGRESS":
+            status(str(text))
+
+    if protocol == "framed":
+        # the board plays our compiled timeline, no recipe table on its side
+        cmd = link.upload(timeline, on_event, ack_timeout=ack_timeout, done_timeout=done_timeout,
+                          cancel=cancel)
+    elif protocol == "legacy":
+        # the old sketch never answers, give it as long as the recipe takes
+        cmd = link.request(f"DISPENSE {mood}", on_event, ack_timeout=ack_timeout,
+                           done_timeout=done_timeout, busy_for=timeline.duration)
+    else:
+        cmd = link.request(f"DISPENSE {mood}", on_event, ack_timeout=ack_timeout,
+                           done_timeout=done_timeout)
+    METRICS.observe("serial_round_trip", cmd.round_trip)
+    print(f"Dispense round trip: {cmd.round_trip:.2f}s")
+    return cmd
@@ -1,21 +1,45 @@
-from pdb import run
+from startup import StartupTimer, Subsystem
+STARTUP = StartupTimer()
+
 import tkinter as tk
-from tkinter import ttk
-from PIL import Image, ImageTk, ImageDraw, ImageOps
-import cv2
 import threading
 import time
-import gpiozero as gz
-from matplotlib import text
-import numpy as np
 
-from picamera2 import Picamera2
+# anything heavy (cv2, numpy, PIL, deepface, serial, picamera2) gets imported
+# by the subsystem that needs it, off the tk thread
+from config import DETECTOR, HOLD_FRAMES, HOLD_GATE, HOLD_SECS, MIN_NEIGHBORS, SCALE_FACTOR
+from dispatcher import UIDispatcher
+import kiosk
+from metrics import METRICS, SNAPSHOT_PATH
+from orders import OrderQueue
+from pipeline import LatestQueue, Pipeline, PowerGovernor, Stage
 
-import serial
-import serial.tools.list_ports
+STARTUP.mark("imports done")
 
 ARDUINO_PORT = "/dev/ttyACM0"   # change if needed: /dev/ttyUSB0
 ARDUINO_BAUD = 115200
+ARDUINO_ACK_TIMEOUT = 2.0     # seconds to wait for the arduino to accept a command
+ARDUINO_DONE_TIMEOUT = 60.0   # seconds to wait for a dispense to finish
+ARDUINO_PROTOCOL = "legacy"   # what the deployed sketch speaks, "text" / "framed" need new firmware (arduino_link.py)
+
+# detection thresholds (DETECTOR, HOLD_*, ...) are in config.py, shared with replay.py / bench.py
+IDLE_AFTER = 8.0    # secs with no face before the scan screen drops to idle
+IDLE_FPS = 5        # capture rate while idle
+IDLE_SCALE = 0.25   # detector search scale while idle (full rate uses 0.5)
+USE_INFERENCE_PROCESS = False   # run the emotion model in its own process
+EMOTION_BACKEND = "keras"   # or "tflite" for the quantized model (emotion_tflite.py)
+INFERENCE_SERVER = None     # e.g. "unix:/tmp/moodmixer.sock" / "tcp:10.0.0.5:9200" (inference_server.py)
+DISPENSER = "arduino"   # or "gpio" to run the pumps straight from this pi (pumps.py)
+USE_ORDER_QUEUE = True  # pour in the background and go straight back to the start screen
+CONFIRM_CUP = True      # queued drinks wait for CUP READY on the start screen before pouring
+CUP_SWAP_SECS = 5.0     # without CONFIRM_CUP, pause this long between queued drinks
+ORDER_ALERT_SECS = 30   # how long a failed order stays up on the start screen
+BLEND_DRINKS = True     # mix recipes by the whole emotion vector (recipes.blend), needs gpio or framed
+
+METRICS_PORT = 9108     # http://127.0.0.1:9108/metrics, None to turn off
+METRICS_SNAPSHOT = SNAPSHOT_PATH   # next to metrics.py, None turns it off
+METRICS_SNAPSHOT_EVERY = 30   # seconds
+SESSION_LOG = True      # one row per customer in sessionlog.SESSION_DB, where `sessionlog.py report` looks
 
 
 MOOD_ADVICE = {
@@ -35,45 +59,170 @@ class FaceScannerApp:
         self.root.geometry("900x800")
         self.root.configure(bg="#0f0f12")  # dark modern background
 
-        self.picam2 = None
         self.running = False
-        self.face_detected = False
-        self.detection_start_time = None
         self.photo_taken = False
-        self.scan_progress = 0
+        self.pipeline = None
+        self.capture_stage = None
+        self.hold = None
 
         self.width = 640
         self.height = 380
         self.radius = 40  # how rounded the corners are
 
-        self.face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
-
-        self.serial = None
-        self.connect_arduino()
+        self.compositor = None
+        self.camera = None
+        self.face_tracker = None
+        self.emotion = None
+        self.arduino = None
+        self.sessions = None
+        self.session = None     # the customer currently on screen
+        self.dispense_cancel = None   # threading.Event for the drink on the making screen
+        self.order_alert = None   # (text, until) for the last failed order
+
+        # heavy stuff comes up in the background so the start screen shows right away
+        self.subsystems = {
+            "vision": Subsystem("vision", self.init_vision, STARTUP),
+            "camera": Subsystem("camera", self.init_camera, STARTUP),
+            "model": Subsystem("model", self.init_inference, STARTUP),
+            "arduino": Subsystem("arduino", self.connect_arduino, STARTUP),
+            "pumps": Subsystem("pumps", self.init_pumps, STARTUP),
+            "log": Subsystem("log", self.init_session_log, STARTUP),
+        }
+        for sub in self.subsystems.values():
+            sub.start()
+
+        # all per-frame ui updates go through here, newest value wins once per tick
+        self.ui = UIDispatcher(self.root, fps=30)
+        self.ui.start()
+
+        # per-stage timings, served on localhost + dumped to a json file
+        if METRICS_PORT:
+            try:
+                METRICS.serve(METRICS_PORT)
+            except OSError as e:
+                print(f"Metrics server not started: {e}")
+        if METRICS_SNAPSHOT:
+            METRICS.write_snapshots(METRICS_SNAPSHOT, METRICS_SNAPSHOT_EVERY)
+
+        # drinks get poured by a background worker while the next person scans
+        self.orders = OrderQueue(
+            self.dispense_order,
+            on_change=lambda q: self.root.after(0, self.update_queue_status),
+            on_failed=lambda order: self.root.after(0, lambda: self.order_failed(order)),
+            between_orders=CUP_SWAP_SECS,
+            confirm_cup=CONFIRM_CUP,
+        )
+        self.orders.start()
 
         self.create_start_screen()
+        self.root.after_idle(lambda: STARTUP.mark("start screen shown"))
+
+    # BACKGROUND INIT
+    def init_vision(self):
+        from detector import FaceTracker, HoldStill, make_detector
+        from overlay import PreviewCompositor
+
+        self.compositor = PreviewCompositor(self.width, self.height, self.radius)
+
+        backend = make_detector(DETECTOR, SCALE_FACTOR, MIN_NEIGHBORS)
+        # downscaled search + roi tracking around the last face
+        self.face_tracker = FaceTracker(backend)
+        self.hold = HoldStill(HOLD_SECS, HOLD_GATE, max_faces=HOLD_FRAMES)
+
+        # full rate while someone's there, slow low-res detection when nobody is
+        self.power = PowerGovernor(
+            IDLE_AFTER, IDLE_FPS, IDLE_SCALE, self.face_tracker.scale, on_change=self.apply_power_profile
+        )
+
+    def apply_power_profile(self, state, profile):
+        # called from the detect thread (or start_scanning) when the power state changes
+        if self.capture_stage:
+            self.capture_stage.set_rate(profile.capture_fps)
+        self.face_tracker.scale = profile.detect_scale
+        print(f"Scanner {state}")
+
+    def init_camera(self):
+        from camera import CameraManager, PicameraSource
+
+        # camera gets opened once and paused between scans, frames come out of a
+        # preallocated pool that the scan pipeline hands back when it's done with them
+        self.camera = CameraManager(PicameraSource(self.width, self.height), mirror=True, pool_size=6)
+        self.camera.open()
+
+    def make_local_inference(self):
+        # the emotion model in this process (or a separate worker process so
+        # tensorflow stays off our gil)
+        if USE_INFERENCE_PROCESS:
+            from inference_worker import InferenceWorker
+            return InferenceWorker(max_batch=HOLD_FRAMES)
+        if EMOTION_BACKEND == "tflite":
+            from emotion_tflite import TFLiteEmotionService
+            return TFLiteEmotionService()
+        from emotion import EmotionService
+        return EmotionService()
+
+    def init_inference(self):
+        # load the emotion model in the background while the start screen is up,
+        # or connect to the venue's shared server and only load locally if it's down
+        if INFERENCE_SERVER:
+            from inference_server import InferenceClient
+            self.emotion = InferenceClient(INFERENCE_SERVER, fallback=self.make_local_inference)
+        else:
+            self.emotion = self.make_local_inference()
+        self.emotion.start()
+        if not self.emotion.wait():
+            raise RuntimeError(self.emotion.error or "model failed to load")
+
+    def init_pumps(self):
+        # compile + validate every recipe now so dispensing just plays them back
+        from recipes import load_blender, load_timelines
+        load_timelines()
+        if BLEND_DRINKS:
+            load_blender()
+
+        # only touch the gpio pins if this pi drives the pumps itself
+        if DISPENSER == "gpio":
+            import pumps
+            pumps.stop_all_pumps()
+
+    def init_session_log(self):
+        if not SESSION_LOG:
+            return False
+        from sessionlog import SESSION_DB, SessionLog
+        self.sessions = SessionLog(SESSION_DB).start()
+
+    def new_session(self):
+        from sessionlog import Session
+        self.session = Session() if self.sessions else None
+
+    def end_session(self, session, outcome, error=None):
+        # queued for the writer thread, nothing touches the disk here
+        if session is not None and self.sessions:
+            self.sessions.log(session, outcome, error)
+
+    def startup_finished(self):
+        return all(sub.finished for sub in self.subsystems.values())
 
     # CONNECTING ARDUINO FOR INPUT
     def connect_arduino(self):
-        # try to open serial port
+        # try to open serial port, replies get read on a background thread
+        import serial
+        import serial.tools.list_ports
+        from arduino_link import LINKS
+
+        link_cls = LINKS[ARDUINO_PROTOCOL]
         try:
-            self.serial = serial.Serial(ARDUINO_PORT, ARDUINO_BAUD, timeout=1)
-            time.sleep(2)
+            self.arduino = link_cls(
+                ARDUINO_PORT, ARDUINO_BAUD,
+                on_unmatched=lambda line: print(f"Arduino: {line}")
+            ).open()
             print(f"Connected to Arduino on {ARDUINO_PORT}")
         except serial.SerialException as e:
+            self.arduino = None
             print(f"Error connecting to Arduino: {(e)}")
             for p in serial.tools.list_ports.comports():
                 print(f" - {p.device}: {p.description}")
-
-
-    # SENDING MESSAGES TO ARDUINO
-    def send_to_arduino(self, message):
-        if not self.serial:
-            raise RuntimeError("Arduino not connected")
-
-        line = (message.strip() + "\n").encode('utf-8')
-        self.serial.write(line)
-        self.serial.flush()
+            return False
 
 
     def create_start_screen(self):
@@ -97,7 +246,26 @@ class FaceScannerApp:
             font=("Helvetica", 14, "bold"),
             bg="#0f0f12",
             fg="#4a4a5e",
-        ).pack(pady=(0, 60))
+        ).pack(pady=(0, 20))
+
+        self.queue_lbl = tk.Label(
+            container,
+            text="",
+            font=("Helvetica", 14, "bold"),
+            bg="#0f0f12",
+            fg="#00ff88",
+        )
+        self.queue_lbl.pack(pady=(0, 40))
+
+        self.alert_lbl = tk.Label(
+            container,
+            text="",
+            font=("Helvetica", 14, "bold"),
+            bg="#0f0f12",
+            fg="#ff4444",
+        )
+        self.alert_lbl.pack(before=self.queue_lbl)
+        self.update_queue_status()
 
         self.start_btn = tk.Label(
             container,
@@ -110,6 +278,7 @@ class FaceScannerApp:
             cursor="hand2"
         )
         self.start_btn.pack()
+        self.create_cup_button(container, before=self.start_btn)
         self.start_btn.bind("<Button-1>", lambda e: self.start_scanning())
         self.start_btn.bind("<Enter>", lambda e: self.start_btn.configure(bg="#e0e0e0"))
         self.start_btn.bind("<Leave>", lambda e: self.start_btn.configure(bg="#ffffff"))
@@ -130,6 +299,107 @@ class FaceScannerApp:
         exit_btn.bind("<Enter>", lambda e: exit_btn.configure(fg="#ff6666"))
         exit_btn.bind("<Leave>", lambda e: exit_btn.configure(fg="#ff4444"))
 
+        self.startup_status_lbl = tk.Label(
+            container,
+            text="",
+            font=("Helvetica", 10),
+            bg="#0f0f12",
+            fg="#4a4a5e"
+        )
+        self.startup_status_lbl.pack(pady=(20, 0))
+        self.update_startup_status()
+
+    def create_cup_button(self, container, before):
+        # only packed while a queued drink is waiting on a fresh cup (CONFIRM_CUP)
+        self.cup_btn = tk.Label(
+            container,
+            text="",
+            font=("Helvetica", 16, "bold"),
+            bg="#00ff88",
+            fg="#0f0f12",
+            padx=40,
+            pady=15,
+            cursor="hand2"
+        )
+        self.cup_btn.bind("<Button-1>", lambda e: self.orders.cup_ready())
+        self.cup_btn_before = before
+        self.update_cup_button()
+
+    def update_cup_button(self):
+        btn = getattr(self, "cup_btn", None)
+        if not btn or not btn.winfo_exists():
+            return
+        held = self.orders.waiting_for_cup
+        if held:
+            btn.config(text=f"CUP READY - POUR #{held.id}")
+            btn.pack(before=self.cup_btn_before, pady=(0, 30))
+        else:
+            btn.pack_forget()
+
+    def update_queue_status(self):
+        # how many drinks are ahead and roughly how long until they're poured
+        self.update_cup_button()
+        lbl = getattr(self, "queue_lbl", None)
+        if not lbl or not lbl.winfo_exists():
+            return
+
+        # a failed order stays up for a bit so whoever is waiting on it sees it
+        alert = self.order_alert if self.order_alert and time.time() < self.order_alert[1] else None
+        self.alert_lbl.config(text=alert[0] if alert else "")
+
+        held = self.orders.waiting_for_cup
+
+        depth = self.orders.depth
+        if depth == 0:
+            lbl.config(text="")
+        else:
+            current = self.orders.current
+            if current:
+                pouring = f"POURING #{current.id} {current.drink_name.upper()}   "
+            elif held:
+                pouring = f"PLACE A CUP FOR #{held.id} {held.drink_name.upper()}   "
+            elif self.orders.pause_until:
+                pouring = f"SWAP CUP {max(self.orders.pause_until - time.time(), 0):.0f}s   "
+            else:
+                pouring = ""
+            lbl.config(text=f"{pouring}QUEUE: {depth}   WAIT ~{self.orders.estimated_wait():.0f}s")
+
+        # wait estimate counts down, keep refreshing while there's a queue or an alert
+        if (depth or alert) and not getattr(self, "queue_refresh_pending", False):
+            self.queue_refresh_pending = True
+
+            def refresh():
+                self.queue_refresh_pending = False
+                self.update_queue_status()
+            self.root.after(1000, refresh)
+
+    def order_failed(self, order):
+        # from the order worker via root.after, the session log already has it
+        self.order_alert = (
+            f"ORDER #{order.id} {order.drink_name.upper()} FAILED - PLEASE ASK STAFF",
+            time.time() + ORDER_ALERT_SECS,
+        )
+        self.update_queue_status()
+
+    def update_startup_status(self):
+        # show each subsystem's state, poll until they're all done
+        lbl = getattr(self, "startup_status_lbl", None)
+        if not lbl or not lbl.winfo_exists():
+            return
+
+        marks = {"idle": "...", "loading": "...", "ready": "OK", "failed": "X"}
+        lbl.config(text="   ".join(
+            f"{name.upper()} {marks[sub.state]}" for name, sub in self.subsystems.items()
+        ))
+
+        if self.startup_finished():
+            if not getattr(self, "startup_reported", False):
+                self.startup_reported = True
+                STARTUP.mark("all subsystems done")
+                print(STARTUP.report())
+        else:
+            self.root.after(250, self.update_startup_status)
+
     def create_scanner_screen(self):
         self._clear_window()
 
@@ -145,6 +415,14 @@ class FaceScannerApp:
         )
         self.canvas.pack(pady=20)
 
+        from preview import PreviewSurface
+        self.preview = PreviewSurface(
+            self.canvas,
+            self.width//2 + 10,
+            self.height//2 + 10,
+            (self.width + 20, self.height + 20)
+        )
+
         # Create text on canvas instead of using Label
         self.status_text_id = self.canvas.create_text(
             (self.width + 20) // 2,
@@ -165,6 +443,9 @@ class FaceScannerApp:
         cancel_lbl.pack(pady=30)
         cancel_lbl.bind("<Button-1>", lambda e: self.cancel_scan())
 
+        # the last customer's drink can be let go while the next one scans
+        self.create_cup_button(self.scanner_container, before=cancel_lbl)
+
 
     def show_report_and_user_selection_screen(self, dominant, emotions):
         # check getting the emotions
@@ -241,7 +522,7 @@ class FaceScannerApp:
         )
 
         make_drink_btn.pack(side="left", padx=10)
-        make_drink_btn.bind("<Button-1>", lambda e: self.start_drink_flow(dominant))
+        make_drink_btn.bind("<Button-1>", lambda e: self.start_drink_flow(dominant, emotions))
 
         again_btn = tk.Label(
             btn_row,
@@ -255,8 +536,13 @@ class FaceScannerApp:
         )
 
         again_btn.pack(side="left", padx=10)
-        again_btn.bind("<Button-1>", lambda e: self.create_start_screen())
+        again_btn.bind("<Button-1>", lambda e: self.scan_again())
+
 
+    def scan_again(self):
+        self.end_session(self.session, "scan_again")
+        self.session = None
+        self.create_start_screen()
 
     def show_making_screen(self, emotion, drink_name):
         self._clear_window()
@@ -355,259 +641,247 @@ class FaceScannerApp:
 
 
     def _clear_window(self):
+        # anything still queued was meant for the old screen
+        self.ui.forget()
         for widget in self.root.winfo_children():
             widget.destroy()
 
     def start_scanning(self):
-        self.create_scanner_screen()
+        # can't scan until the camera and detector are up
+        if not (self.subsystems["vision"].ready and self.subsystems["camera"].ready):
+            self.start_btn.configure(text="WARMING UP...")
+            self.root.after(1000, lambda: self.start_btn.winfo_exists() and self.start_btn.configure(text="BEGIN SCAN"))
+            return
 
-        self.picam2 = Picamera2()
+        self.create_scanner_screen()
+        self.new_session()
 
-        config = self.picam2.create_preview_configuration(
-            main={"size": (self.width, self.height), "format": "RGB888"}
-        )
-        self.picam2.configure(config)
-        self.picam2.start()
+        self.camera.acquire()
 
         self.running = True
         self.photo_taken = False
-        self.face_detected = False
-        self.detection_start_time = None
-
-        threading.Thread(target=self.update_frame, daemon=True).start()
-
-    def round_rectangle(self, size, radius, fill):
-        width, height = size
-        circle = Image.new('L', (radius * 2, radius * 2), 0)
-        draw = ImageDraw.Draw(circle)
-        draw.ellipse((0, 0, radius * 2, radius * 2), fill=255)
-
-        alpha = Image.new('L', size, 255)
-        w, h = size
-
-        alpha.paste(circle.crop((0, 0, radius, radius)), (0, 0))
-        alpha.paste(circle.crop((0, radius, radius, radius * 2)), (0, h - radius))
-        alpha.paste(circle.crop((radius, 0, radius * 2, radius)), (w - radius, 0))
-        alpha.paste(circle.crop((radius, radius, radius * 2, radius * 2)), (w - radius, h - radius))
-
-        draw = ImageDraw.Draw(alpha)
-        draw.rectangle((radius, 0, w - radius, h), fill=255)
-        draw.rectangle((0, radius, w, h - radius), fill=255)
-
-        return alpha
-
-    def add_corners(self, im, rad):
-        circle = Image.new('L', (rad * 2, rad * 2), 0)
-        draw = ImageDraw.Draw(circle)
-        draw.ellipse((0, 0, rad * 2, rad * 2), fill=255)
-
-        alpha = Image.new('L', im.size, 255)
-        w, h = im.size
-
-        alpha.paste(circle.crop((0, 0, rad, rad)), (0, 0))
-        alpha.paste(circle.crop((0, rad, rad, rad * 2)), (0, h - rad))
-        alpha.paste(circle.crop((rad, 0, rad * 2, rad)), (w - rad, 0))
-        alpha.paste(circle.crop((rad, rad, rad * 2, rad * 2)), (w - rad, h - rad))
-
-        im.putalpha(alpha)
-        return im
-
-    def update_frame(self):
-        while self.running and not self.photo_taken:
-            frame = self.picam2.capture_array()
-
-            frame_bgr = frame
-
-            frame_bgr = cv2.flip(frame_bgr, 1)
-
-            gray = cv2.cvtColor(frame_bgr, cv2.COLOR_BGR2GRAY)
-            faces = self.face_cascade.detectMultiScale(gray, 1.2, 5)
-
-            if len(faces) > 0:
-                if not self.face_detected:
-                    self.face_detected = True
-                    self.detection_start_time = time.time()
-
-                elapsed = time.time() - self.detection_start_time
-                progress = min(elapsed / 2.0, 1.0)
-
-                if progress >= 0.25:
-                    self.photo_taken = True
-                    self.picam2.stop()
-                    self.picam2.close()
-                    self.picam2 = None
-                    self.root.after(0, lambda: self.capture_and_analyze(frame_bgr))
-                    break
-
-                ring_color = (0, 255, 136)
-                status_text = "Hold still..."
-            else:
-                self.face_detected = False
-                self.detection_start_time = None
-                progress = 0
-                ring_color = (255, 68, 68)
-                status_text = "Searching for face..."
-
-            self.root.after(0, lambda text=status_text: self.update_status(text))
-
-            img_rgb = cv2.cvtColor(frame_bgr, cv2.COLOR_BGR2RGB)
-            pil_img = Image.fromarray(img_rgb)
-
-            pil_img = self.add_corners(pil_img, self.radius)
-
-            # draw the ring/border
-            # make a transparent layer just for this
-            output_img = Image.new('RGBA', (self.width + 20, self.height + 20), (0, 0, 0, 0))
-            output_img.paste(pil_img, (10, 10), pil_img)
+        from overlay import RING_RED
+        self.ring_color = RING_RED
+        self.hold.reset()
+        self.face_tracker.reset()
+
+        # capture -> (detect, render), each stage only ever sees the newest frame
+        detect_q = LatestQueue()
+        render_q = LatestQueue()
+        self.capture_stage = Stage("capture", self.capture_frame, outputs=[detect_q, render_q])
+        self.pipeline = Pipeline([
+            self.capture_stage,
+            Stage("detect", self.detect_faces, inbox=detect_q),
+            Stage("render", self.render_preview, inbox=render_q, max_rate=30),
+        ], pool=self.camera.pool)
+        self.power.reset()
+        self.pipeline.start()
+
+    def stop_pipeline(self):
+        if self.pipeline:
+            print(f"Pipeline: {self.pipeline.summary()}")
+            print(f"Detector: {self.face_tracker.summary()}")
+            if self.camera.first_frame_latency is not None:
+                print(f"Time to first frame: {self.camera.first_frame_latency * 1000:.0f}ms")
+            self.pipeline.stop()
+            self.pipeline = None
+            self.capture_stage = None
+            self.power.pause()
+            print(f"Power: {self.power.summary()}")
+
+    def capture_frame(self):
+        # camera manager mirrors it for us
+        return self.camera.capture()
+
+    def detect_faces(self, frame_bgr):
+        if self.photo_taken:
+            return
 
-            draw = ImageDraw.Draw(output_img)
+        state, power = kiosk.scan_step(self.face_tracker, self.hold, frame_bgr, time.time(), self.power)
 
-            x0, y0 = 10, 10
-            x1, y1 = self.width + 10, self.height + 10
-            r = self.radius
+        if state == "captured":
+            # one batched emotion pass over the crops from the hold-still window
+            self.photo_taken = True
+            crops = kiosk.take_crops(self.hold, time.time(), self.session)
+            self.root.after(0, lambda: self.finish_capture(crops))
+            return
 
-            # set the color
-            color = ring_color
+        self.ring_color, status_text = kiosk.scan_feedback(state, power)
+        self.ui.post("status", self.update_status, status_text, dedupe=True)
 
-            # make it thick enough to see
-            stroke = 6
-            # corners
-            draw.arc((x0, y0, x0 + r*2, y0 + r*2), 180, 270, fill=color, width=stroke)
-            draw.arc((x1 - r*2, y0, x1, y0 + r*2), 270, 0, fill=color, width=stroke)
-            draw.arc((x0, y1 - r*2, x0 + r*2, y1), 90, 180, fill=color, width=stroke)
-            draw.arc((x1 - r*2, y1 - r*2, x1, y1), 0, 90, fill=color, width=stroke)
+    def render_preview(self, frame_bgr):
+        # idle is detection only, the last frame just stays up
+        if self.photo_taken or not self.power.profile.render:
+            return
 
-            # lines connecting corners
-            draw.line((x0 + r, y0, x1 - r, y0), fill=color, width=stroke)
-            draw.line((x0 + r, y1, x1 - r, y1), fill=color, width=stroke)
-            draw.line((x0, y0 + r, x0, y1 - r), fill=color, width=stroke)
-            draw.line((x1, y0 + r, x1, y1 - r), fill=color, width=stroke)
+        # cached rounded mask + ring, blended into one reused buffer
+        # (under the surface lock so tk never pastes a half written frame)
+        with self.preview.lock, METRICS.time("overlay_composite"):
+            output_img = self.compositor.compose_image(frame_bgr, self.ring_color, self.camera.flip_in_blit)
 
-            imgtk = ImageTk.PhotoImage(image=output_img)
-            self.root.after(0, lambda i=imgtk: self.update_canvas(i))
+        self.ui.post("preview", self.update_canvas, output_img)
 
-            time.sleep(0.05)
+    def finish_capture(self, faces):
+        self.stop_pipeline()
+        self.camera.release()
+        self.capture_and_analyze(faces)
 
-    def update_canvas(self, imgtk):
+    def update_canvas(self, image):
         if not self.running: return
-        self.canvas.create_image(
-            self.width//2 + 10,
-            self.height//2 + 10,
-            anchor=tk.CENTER,
-            image=imgtk
-        )
-        self.canvas.imgtk = imgtk
+        # paste into the one PhotoImage the canvas already shows
+        with METRICS.time("photoimage"):
+            self.preview.show(image)
 
     def update_status(self, text):
-        # Update canvas text instead of label
-        if hasattr(self, 'status_text_id'):
-            self.canvas.itemconfig(self.status_text_id, text=text)
-        elif hasattr(self, 'status_label'):
+        # whichever status widget is on screen right now
+        if hasattr(self, 'status_label') and self.status_label.winfo_exists():
             self.status_label.config(text=text)
+        elif hasattr(self, 'status_text_id') and self.canvas.winfo_exists():
+            # Update canvas text instead of label
+            self.canvas.itemconfig(self.status_text_id, text=text)
 
-    def capture_and_analyze(self, frame):
-        self.update_status("Analyzing...")
-
-        cv2.imwrite("captured_face.jpg", frame)
+    def capture_and_analyze(self, faces):
+        # through the dispatcher like the scan statuses, so a "Hold still..."
+        # still pending there can't land on top of it next tick
+        self.ui.post("status", self.update_status, "Analyzing...", dedupe=True)
 
         # freeze the video
+        session = self.session
 
         def analyze():
-            print("\n" + "="*60)
-            print("  MOODMIXER ANALYSIS RESULT")
-            print("="*60)
-
             try:
-                from deepface import DeepFace
-
-                result = DeepFace.analyze(
-                    "captured_face.jpg",
-                    actions=['emotion'],
-                    enforce_detection=False,
-                    silent=True
-                )
-
-                if isinstance(result, list):
-                    emotions = result[0]['emotion']
-                else:
-                    emotions = result['emotion']
+                if not self.subsystems["model"].wait(60):
+                    raise RuntimeError(self.subsystems["model"].error or "Emotion model not available")
 
-                sorted_emotions = sorted(emotions.items(), key=lambda x: x[1], reverse=True)
-
-                print("\n  DETECTED EMOTIONS:")
-                print("  " + "-" * 56)
-                for emotion, confidence in sorted_emotions:
-                    bar_len = int(confidence / 2.5)
-                    bar = "█" * bar_len
-                    print(f"  {emotion.upper():<12} | {bar:<40} {confidence:.1f}%")
-
-                print("\n  " + "-" * 56)
-                print(f"  DOMINANT: {sorted_emotions[0][0].upper()}")
-                print("="*60 + "\n")
+                # one forward pass over every frame from the hold-still window
+                dominant, emotions = kiosk.analyze_faces(self.emotion, faces, session)
 
                 # update ui to show we're done
-                dominant = sorted_emotions[0][0].upper()
                 self.root.after(0, lambda d=dominant, emo=emotions: self.show_report_and_user_selection_screen(d, emo))
 
 
-            except ImportError:
-                print("\nERROR: DeepFace not installed! Run `pip install deepface`\n")
             except Exception as e:
                 print(f"\nERROR: {str(e)}\n")
-                self.root.after(0, self.cancel_scan)
+                self.root.after(0, lambda err=e: self.analysis_failed(session, err))
 
         threading.Thread(target=analyze, daemon=True).start()
 
-    def start_drink_flow(self, dominant: str):
+    def analysis_failed(self, session, error):
+        # logged as failed, not as the customer walking off
+        if self.session is session:
+            self.session = None
+        self.end_session(session, "failed", error)
+        self.cancel_scan()
 
-        if not self.serial:
+    def start_drink_flow(self, dominant: str, emotions=None):
+
+        if DISPENSER == "arduino" and not self.arduino:
             self.update_status("Arduino not connected")
             return
+        if DISPENSER == "gpio" and not self.subsystems["pumps"].ready:
+            self.update_status("Pumps not ready")
+            return
 
-        # choose drink
-
+        # this customer's session now belongs to their drink
+        session, self.session = self.session, None
         dominant = dominant.upper()
-        drink_name = f"{dominant.title()} Mix"
+        timeline = kiosk.choose_timeline(
+            dominant, emotions, BLEND_DRINKS,
+            kiosk.can_blend(DISPENSER, ARDUINO_PROTOCOL), session
+        )
+        drink_name = timeline.name
         self.last_drink_name = drink_name
 
+        if USE_ORDER_QUEUE:
+            # pour in the background, next person can scan right away
+            order = self.orders.submit(dominant, timeline, session)
+            print(f"Order #{order.id} queued: {drink_name}")
+            self.create_start_screen()
+            return
+
         self.show_making_screen(dominant, drink_name)
 
         def status(msg):
-            self.root.after(0, lambda: self.update_status(msg))
-
-        def do_serial():
-            try:
-                status("sending command to Arduino")
-                self.send_to_arduino(f"DISPENSE {dominant}")
+            self.ui.post("status", self.update_status, msg, dedupe=True)
 
-                status("dispensing...")
-                time.sleep(2)
+        # the making screen's CANCEL sets this, stops the pumps mid recipe
+        cancel = self.dispense_cancel = threading.Event()
 
+        def do_dispense():
+            t0 = time.time()
+            try:
+                self.dispense(dominant, timeline, status, cancel)
+                if session:
+                    session.timings["dispense"] = time.time() - t0
+                self.end_session(session, "done")
 
                 status("Drink ready")
                 self.root.after(800, lambda: self.show_done_screen(dominant, drink_name))
 
             except Exception as e:
-                print(f"Serial error: {e}")
+                if cancel.is_set():
+                    # cancel_scan already took us back to the start screen
+                    print(f"Dispense cancelled: {e}")
+                    self.end_session(session, "cancelled")
+                    return
+                print(f"Dispense error: {e}")
+                self.end_session(session, "failed", e)
                 self.root.after(0, self.cancel_scan)
 
-        threading.Thread(target=do_serial, daemon=True).start()
+        threading.Thread(target=do_dispense, daemon=True).start()
+
+    def dispense(self, mood, timeline, status, cancel=None):
+        # blocks until the drink is poured, raises if it wasn't
+        # cancel = threading.Event, stops the pumps mid recipe (gpio / framed)
+        kiosk.dispense(
+            mood, timeline, status, cancel,
+            dispenser=DISPENSER, link=self.arduino, protocol=ARDUINO_PROTOCOL,
+            ack_timeout=ARDUINO_ACK_TIMEOUT, done_timeout=ARDUINO_DONE_TIMEOUT
+        )
+
+    def dispense_order(self, order, status):
+        # runs on the order queue's worker, logs the session once the drink is out
+        session = order.session
+        if session:
+            session.timings["queue"] = order.started - order.created
+        try:
+            self.dispense(order.mood, order.timeline, status, order.cancel)
+        except Exception as e:
+            self.end_session(session, "failed", e)
+            raise
+        if session:
+            session.timings["dispense"] = time.time() - order.started
+        self.end_session(session, "done")
 
     def cancel_scan(self):
+        if self.dispense_cancel:
+            self.dispense_cancel.set()
+            self.dispense_cancel = None
+        self.end_session(self.session, "cancelled")
+        self.session = None
         self.running = False
-
-        if self.picam2:
-            self.picam2.stop()
-            self.picam2 = None
+        self.stop_pipeline()
+        self.camera.release()
         self.create_start_screen()
 
     def on_closing(self):
         self.running = False
-        if self.picam2:
-            self.picam2.stop()
+        if self.dispense_cancel:
+            self.dispense_cancel.set()
+        self.stop_pipeline()
+        self.orders.stop()
+        self.ui.stop()
+        if self.sessions:
+            self.end_session(self.session, "cancelled")
+            self.sessions.close()
+        METRICS.stop()
+        if self.camera:
+            self.camera.close()
+        if self.emotion:
+            self.emotion.stop()
         try:
-            if self.serial:
-                self.serial.close()
+            if self.arduino:
+                self.arduino.close()
         except Exception:
             pass
         self.root.destroy()
@@ -0,0 +1,175 @@
+import bisect
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# in-memory latency histograms for every stage, exposed as prometheus text on
+# localhost and dumped to a json file every so often
+#   from metrics import METRICS
+#   with METRICS.time("face_detect"): ...
+#   METRICS.observe("inference", secs)
+
+# next to the code, not wherever the kiosk happened to be started from
+HERE = os.path.dirname(os.path.abspath(__file__))
+SNAPSHOT_PATH = os.path.join(HERE, "metrics_snapshot.json")
+
+# bucket upper bounds in seconds, 0.5ms .. 60s
+BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.02, 0.035, 0.05, 0.075, 0.1,
+    0.15, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0,
+)
+
+
+class Histogram:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)   # last one is +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, secs):
+        i = bisect.bisect_left(self.buckets, secs)
+        with self._lock:
+            self.counts[i] += 1
+            self.count += 1
+            self.sum += secs
+            if secs > self.max:
+                self.max = secs
+
+    def quantile(self, q):
+        # upper bound of the bucket the quantile falls in, good enough for dashboards
+        with self._lock:
+            counts, total, top = list(self.counts), self.count, self.max
+        if not total:
+            return 0.0
+        rank = q * total
+        seen = 0
+        for i, c in enumerate(counts):
+            seen += c
+            if seen >= rank:
+                return min(self.buckets[i], top) if i < len(self.buckets) else top
+        return top
+
+    def snapshot(self):
+        return {
+            "count": self.count,
+            "sum_s": self.sum,
+            "mean_ms": self.sum / self.count * 1000 if self.count else 0.0,
+            "p50_ms": self.quantile(0.5) * 1000,
+            "p90_ms": self.quantile(0.9) * 1000,
+            "p99_ms": self.quantile(0.99) * 1000,
+            "max_ms": self.max * 1000,
+        }
+
+
+class Metrics:
+    def __init__(self, prefix="moodmixer"):
+        self.prefix = prefix
+        self.started = time.time()
+        self._hists = {}
+        self._lock = threading.Lock()
+        self._server = None
+
+    def histogram(self, stage):
+        h = self._hists.get(stage)
+        if h is None:
+            with self._lock:
+                h = self._hists.setdefault(stage, Histogram())
+        return h
+
+    def observe(self, stage, secs):
+        self.histogram(stage).observe(secs)
+
+    @contextmanager
+    def time(self, stage):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - t0)
+
+    def snapshot(self):
+        return {
+            "time": time.time(),
+            "uptime_s": time.time() - self.started,
+            "stages": {name: h.snapshot() for name, h in sorted(self._hists.items())},
+        }
+
+    def prometheus(self):
+        name = f"{self.prefix}_stage_seconds"
+        lines = [
+            f"# HELP {name} Time spent in each scan/dispense stage.",
+            f"# TYPE {name} histogram",
+        ]
+        for stage, h in sorted(self._hists.items()):
+            with h._lock:
+                counts, total, s = list(h.counts), h.count, h.sum
+            cumulative = 0
+            for bound, c in zip(h.buckets, counts):
+                cumulative += c
+                lines.append(f'{name}_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+            lines.append(f'{name}_bucket{{stage="{stage}",le="+Inf"}} {total}')
+            lines.append(f'{name}_sum{{stage="{stage}"}} {s}')
+            lines.append(f'{name}_count{{stage="{stage}"}} {total}')
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port=9108, host="127.0.0.1"):
+        # /metrics -> prometheus text, /metrics.json -> same thing as json
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == "/metrics":
+                    body = metrics.prometheus().encode()
+                    ctype = "text/plain; version=0.0.4"
+                elif self.path == "/metrics.json":
+                    body = json.dumps(metrics.snapshot(), indent=2).encode()
+                    ctype = "application/json"
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", ctype)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name="metrics-http", daemon=True).start()
+        print(f"Metrics on http://{host}:{port}/metrics")
+
+    def write_snapshots(self, path, interval=30.0):
+        # rewrite path every interval seconds, via a temp file so readers never see half of it
+        def loop():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.write_snapshot(path)
+                except Exception as e:
+                    # full disk / read-only mount, try again next round
+                    print(f"Metrics snapshot failed: {e}")
+
+        threading.Thread(target=loop, name="metrics-snapshot", daemon=True).start()
+
+    def write_snapshot(self, path):
+        tmp = path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.snapshot(), f, indent=2)
+        os.replace(tmp, path)
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server = None
+
+
+METRICS = Metrics()
@@ -0,0 +1,148 @@
+import itertools
+import queue
+import threading
+import time
+
+
+class Order:
+    def __init__(self, order_id, mood, timeline, session=None):
+        self.id = order_id
+        self.mood = mood
+        self.timeline = timeline
+        self.session = session      # sessionlog.Session, if logging is on
+        self.drink_name = timeline.name
+        self.status = "queued"      # queued -> (waiting_cup) -> dispensing -> done / failed
+        self.error = None
+        self.cancel = threading.Event()     # stops the pour mid recipe
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+
+    @property
+    def expected_secs(self):
+        return self.timeline.duration
+
+
+class OrderQueue:
+    # confirmed drinks go in here and a background worker dispenses them one at a
+    # time, so the kiosk can go back to scanning the next person straight away
+
+    def __init__(self, dispense_fn, on_change=None, on_failed=None, between_orders=5.0, confirm_cup=False):
+        # dispense_fn(order, status_cb) blocks until the drink is done, raises on failure
+        # on_failed(order) gets called from the worker thread, order.error says why
+        # confirm_cup: every drink waits for cup_ready() instead of a timed pause
+        self.dispense_fn = dispense_fn
+        self.on_change = on_change
+        self.on_failed = on_failed
+        self.between_orders = between_orders   # time to swap cups
+        self.confirm_cup = confirm_cup
+        self.current = None
+        self.waiting_for_cup = None     # order held until someone confirms a cup
+        self.pause_until = None         # end of the timed cup swap, when not confirming
+        self._queue = queue.Queue()
+        self._waiting = []
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._running = False
+        self._thread = None
+        self._cup = threading.Event()
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._work, name="order-queue", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        # whatever is pouring gets cancelled, the rest stays unpoured
+        self._running = False
+        current = self.current
+        if current:
+            current.cancel.set()
+        self._cup.set()
+        self._queue.put(None)
+
+    def cup_ready(self):
+        # the kiosk's CUP READY button, lets the held order pour
+        self._cup.set()
+
+    def submit(self, mood, timeline, session=None):
+        order = Order(next(self._ids), mood, timeline, session)
+        with self._lock:
+            self._waiting.append(order)
+        self._queue.put(order)
+        self._changed()
+        return order
+
+    @property
+    def depth(self):
+        # drinks not finished yet, including the one being poured
+        with self._lock:
+            return len(self._waiting) + (1 if self.current else 0)
+
+    def estimated_wait(self):
+        # seconds until a drink ordered now would start
+        with self._lock:
+            waiting = list(self._waiting)
+            current = self.current
+
+        # confirming a cup has no fixed pause to count
+        gap = 0.0 if self.confirm_cup else self.between_orders
+        wait = sum(o.expected_secs + gap for o in waiting)
+        if current:
+            elapsed = time.time() - current.started
+            wait += max(current.expected_secs - elapsed, 0) + gap
+        return wait
+
+    def _changed(self):
+        if self.on_change:
+            self.on_change(self)
+
+    def _work(self):
+        while self._running:
+            order = self._queue.get()
+            if order is None:
+                break
+
+            if self.confirm_cup and not self._wait_for_cup(order):
+                break
+
+            with self._lock:
+                self._waiting.remove(order)
+                self.current = order
+            order.status = "dispensing"
+            order.started = time.time()
+            self._changed()
+
+            def status(msg, order=order):
+                print(f"Order #{order.id}: {msg}")
+
+            try:
+                self.dispense_fn(order, status)
+                order.status = "done"
+            except Exception as e:
+                order.status = "failed"
+                order.error = str(e)
+                print(f"Order #{order.id} failed: {e}")
+                if self.on_failed:
+                    self.on_failed(order)
+            order.finished = time.time()
+
+            with self._lock:
+                self.current = None
+            self._changed()
+
+            if not self.confirm_cup and self.between_orders and not self._queue.empty():
+                self.pause_until = time.time() + self.between_orders
+                self._changed()
+                time.sleep(self.between_orders)
+                self.pause_until = None
+                self._changed()
+
+    def _wait_for_cup(self, order):
+        self._cup.clear()
+        order.status = "waiting_cup"
+        self.waiting_for_cup = order
+        self._changed()
+        self._cup.wait()
+        self.waiting_for_cup = None
+        return self._running
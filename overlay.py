@@ -0,0 +1,97 @@
+import numpy as np
+from PIL import Image, ImageDraw
+
+# ring colours used by the scanner preview
+RING_GREEN = (0, 255, 136)
+RING_RED = (255, 68, 68)
+
+# (size, radius, pad, stroke) -> corner alpha mask
+_mask_cache = {}
+# (size, radius, pad, stroke, color) -> (ring mask, color array)
+_ring_cache = {}
+
+
+def corner_mask(size, radius, pad=10, stroke=6):
+    # alpha for the padded output image: 255 inside the rounded rect, 0 outside
+    key = (size, radius, pad, stroke)
+    if key not in _mask_cache:
+        w, h = size
+        alpha = Image.new('L', (w + pad * 2, h + pad * 2), 0)
+        draw = ImageDraw.Draw(alpha)
+        draw.rounded_rectangle((pad, pad, pad + w - 1, pad + h - 1), radius=radius, fill=255)
+        _mask_cache[key] = np.asarray(alpha).copy()
+    return _mask_cache[key]
+
+
+def ring_overlay(size, radius, color, pad=10, stroke=6):
+    # bool mask of where the ring is drawn, plus the colour to put there
+    key = (size, radius, pad, stroke, color)
+    if key not in _ring_cache:
+        w, h = size
+        ring = Image.new('L', (w + pad * 2, h + pad * 2), 0)
+        draw = ImageDraw.Draw(ring)
+
+        x0, y0 = pad, pad
+        x1, y1 = w + pad, h + pad
+        r = radius
+
+        # corners
+        draw.arc((x0, y0, x0 + r*2, y0 + r*2), 180, 270, fill=255, width=stroke)
+        draw.arc((x1 - r*2, y0, x1, y0 + r*2), 270, 0, fill=255, width=stroke)
+        draw.arc((x0, y1 - r*2, x0 + r*2, y1), 90, 180, fill=255, width=stroke)
+        draw.arc((x1 - r*2, y1 - r*2, x1, y1), 0, 90, fill=255, width=stroke)
+
+        # lines connecting corners
+        draw.line((x0 + r, y0, x1 - r, y0), fill=255, width=stroke)
+        draw.line((x0 + r, y1, x1 - r, y1), fill=255, width=stroke)
+        draw.line((x0, y0 + r, x0, y1 - r), fill=255, width=stroke)
+        draw.line((x1, y0 + r, x1, y1 - r), fill=255, width=stroke)
+
+        mask = np.asarray(ring)[..., None] > 0
+        _ring_cache[key] = (mask, np.array(color, dtype=np.uint8))
+    return _ring_cache[key]
+
+
+class PreviewCompositor:
+    # builds the rounded, ringed preview into one reused RGBA buffer
+
+    def __init__(self, width, height, radius, pad=10, stroke=6):
+        self.size = (width, height)
+        self.radius = radius
+        self.pad = pad
+        self.stroke = stroke
+
+        self.buffer = np.zeros((height + pad * 2, width + pad * 2, 4), dtype=np.uint8)
+        # shares memory with buffer, so it always shows the latest compose()
+        self.image = Image.frombuffer(
+            'RGBA', (width + pad * 2, height + pad * 2), self.buffer, 'raw', 'RGBA', 0, 1
+        )
+        self.alpha = corner_mask(self.size, radius, pad, stroke)
+
+        # ring pixels are always opaque even where they sit outside the rounded rect
+        self._alphas = {}
+
+    def _alpha_for(self, color):
+        if color not in self._alphas:
+            ring_mask, _ = ring_overlay(self.size, self.radius, color, self.pad, self.stroke)
+            self._alphas[color] = np.where(ring_mask[..., 0], 255, self.alpha).astype(np.uint8)
+        return self._alphas[color]
+
+    def compose(self, frame_bgr, color, mirror=False):
+        p = self.pad
+        w, h = self.size
+        out = self.buffer
+
+        # BGR -> RGB (and the selfie mirror) while copying into the buffer,
+        # both are just strides so there's no separate cvtColor / flip
+        out[p:p + h, p:p + w, :3] = frame_bgr[:, ::-1, 2::-1] if mirror else frame_bgr[..., 2::-1]
+
+        ring_mask, ring_color = ring_overlay(self.size, self.radius, color, self.pad, self.stroke)
+        np.copyto(out[..., :3], ring_color, where=ring_mask)
+        out[..., 3] = self._alpha_for(color)
+
+        return out
+
+    def compose_image(self, frame_bgr, color, mirror=False):
+        self.compose(frame_bgr, color, mirror)
+        return self.image
@@ -0,0 +1,273 @@
+import threading
+import time
+from typing import NamedTuple
+
+
+class LatestQueue:
+    # bounded queue that only keeps the newest item, older ones get dropped
+
+    def __init__(self, on_drop=None):
+        self._item = None
+        self._has_item = False
+        self._cond = threading.Condition()
+        self.on_drop = on_drop      # gets items that were replaced / cleared unseen
+        self.dropped = 0
+
+    def put(self, item):
+        with self._cond:
+            if self._has_item:
+                self.dropped += 1
+                if self.on_drop:
+                    self.on_drop(self._item)
+            self._item = item
+            self._has_item = True
+            self._cond.notify()
+
+    def get(self, timeout=None):
+        # returns None if nothing new showed up in time
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._has_item, timeout):
+                return None
+            item = self._item
+            self._item = None
+            self._has_item = False
+            return item
+
+    def clear(self):
+        with self._cond:
+            if self._has_item and self.on_drop:
+                self.on_drop(self._item)
+            self._item = None
+            self._has_item = False
+
+
+class StageStats:
+    # rolling throughput + busy time for one stage
+
+    def __init__(self, name, window=2.0):
+        self.name = name
+        self.window = window
+        self.count = 0
+        self.fps = 0.0
+        self.avg_ms = 0.0
+        self._n = 0
+        self._busy = 0.0
+        self._window_start = time.monotonic()
+
+    def record(self, secs):
+        self.count += 1
+        self._n += 1
+        self._busy += secs
+
+        now = time.monotonic()
+        elapsed = now - self._window_start
+        if elapsed >= self.window:
+            self.fps = self._n / elapsed
+            self.avg_ms = self._busy / self._n * 1000
+            self._n = 0
+            self._busy = 0.0
+            self._window_start = now
+
+
+class Stage:
+    # one worker thread: pull newest item from inbox, run fn, push result to outputs
+    # a stage with no inbox is a source and calls fn() with no args
+
+    def __init__(self, name, fn, inbox=None, outputs=(), max_rate=None):
+        self.name = name
+        self.fn = fn
+        self.inbox = inbox
+        self.outputs = list(outputs)
+        self.min_interval = 1.0 / max_rate if max_rate else 0.0
+        self.stats = StageStats(name)
+        self.pool = None    # set by Pipeline, frames get retained / released against it
+        self.running = False
+        self._thread = None
+
+    def start(self):
+        self.running = True
+        self._thread = threading.Thread(target=self._loop, name=f"stage-{self.name}", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self.running = False
+
+    def set_rate(self, max_rate):
+        # change the cap while running, None = as fast as the inbox / source goes
+        self.min_interval = 1.0 / max_rate if max_rate else 0.0
+
+    def join(self, timeout=None):
+        if self._thread and self._thread is not threading.current_thread():
+            self._thread.join(timeout)
+
+    def _loop(self):
+        next_due = time.monotonic()
+        while self.running:
+            if self.inbox is not None:
+                item = self.inbox.get(timeout=0.1)
+                if item is None:
+                    continue
+
+            t0 = time.monotonic()
+            try:
+                result = self.fn() if self.inbox is None else self.fn(item)
+            except Exception as e:
+                print(f"Stage {self.name} error: {e}")
+                self.running = False
+                break
+            finally:
+                if self.pool is not None and self.inbox is not None:
+                    self.pool.release(item)
+            self.stats.record(time.monotonic() - t0)
+
+            if result is not None:
+                # one reference per queue, then drop the one fn() handed us
+                if self.pool is not None:
+                    self.pool.retain(result, len(self.outputs))
+                for q in self.outputs:
+                    q.put(result)
+                if self.pool is not None:
+                    self.pool.release(result)
+
+            # cap the rate with a deadline instead of a fixed sleep
+            if self.min_interval:
+                next_due = max(next_due + self.min_interval, t0)
+                delay = next_due - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+
+
+class Pipeline:
+    def __init__(self, stages, pool=None):
+        # pool: the FramePool the source stage captures into (camera.py)
+        self.stages = stages
+        self.pool = pool
+        if pool is not None:
+            for s in stages:
+                s.pool = pool
+                if s.inbox is not None:
+                    s.inbox.on_drop = pool.release
+
+    def start(self):
+        for s in self.stages:
+            s.start()
+
+    def stop(self, timeout=1.0):
+        for s in self.stages:
+            s.stop()
+        for s in self.stages:
+            s.join(timeout)
+        # frames nobody got to go back to the pool
+        for s in self.stages:
+            if s.inbox is not None:
+                s.inbox.clear()
+
+    def stats(self):
+        out = {}
+        for s in self.stages:
+            out[s.name] = {
+                "fps": s.stats.fps,
+                "avg_ms": s.stats.avg_ms,
+                "count": s.stats.count,
+                "dropped": s.inbox.dropped if s.inbox is not None else 0,
+            }
+        return out
+
+    def summary(self):
+        return " | ".join(
+            f"{name} {st['fps']:.0f}fps {st['avg_ms']:.0f}ms"
+            for name, st in self.stats().items()
+        )
+
+
+class Profile(NamedTuple):
+    capture_fps: float      # None = whatever the camera does
+    detect_scale: float     # search image scale for FaceTracker
+    render: bool            # composite + show the preview at all
+
+
+class PowerGovernor:
+    # picks how hard the scan pipeline works from whether anyone is there:
+    #   active     face in frame, everything at full rate
+    #   searching  no face yet, still full rate so someone stepping in is picked up
+    #   idle       nobody for idle_after secs, slow low res detection only
+    # any face goes straight back to active. cpu + wall time is kept per state
+
+    def __init__(self, idle_after=8.0, idle_fps=5, idle_scale=0.25, full_scale=0.5, on_change=None):
+        self.idle_after = idle_after
+        self.profiles = {
+            "active": Profile(None, full_scale, True),
+            "searching": Profile(None, full_scale, True),
+            "idle": Profile(idle_fps, idle_scale, False),
+        }
+        self.on_change = on_change      # on_change(state, profile)
+        self.state = None
+        self.last_face = None
+        self.cpu = {name: 0.0 for name in self.profiles}
+        self.wall = {name: 0.0 for name in self.profiles}
+        self.transitions = 0
+        self._since = None
+        self._lock = threading.Lock()
+
+    @property
+    def profile(self):
+        return self.profiles[self.state or "searching"]
+
+    def reset(self, now=None):
+        # new scan, start out searching at full rate
+        self.last_face = now if now is not None else time.monotonic()
+        self._enter("searching")
+
+    def update(self, face_seen, now=None):
+        now = now if now is not None else time.monotonic()
+        if face_seen:
+            self.last_face = now
+            state = "active"
+        elif self.last_face is None or now - self.last_face < self.idle_after:
+            state = "searching"
+        else:
+            state = "idle"
+
+        if state != self.state:
+            self._enter(state)
+        return state
+
+    def pause(self):
+        # scan screen closed, stop charging time to whatever state it was in
+        self._enter(None)
+
+    def _enter(self, state):
+        with self._lock:
+            wall, cpu = time.monotonic(), time.process_time()
+            if self.state is not None and self._since is not None:
+                self.wall[self.state] += wall - self._since[0]
+                self.cpu[self.state] += cpu - self._since[1]
+            if state is not None and self.state is not None:
+                self.transitions += 1
+            self.state = state
+            self._since = (wall, cpu) if state is not None else None
+
+        if state is not None and self.on_change:
+            self.on_change(state, self.profiles[state])
+
+    def report(self):
+        # {state: {wall_s, cpu_s, cpu_pct}}, cpu_pct is of one core
+        with self._lock:
+            wall, cpu = dict(self.wall), dict(self.cpu)
+            if self.state is not None and self._since is not None:
+                wall[self.state] += time.monotonic() - self._since[0]
+                cpu[self.state] += time.process_time() - self._since[1]
+        return {
+            name: {
+                "wall_s": wall[name],
+                "cpu_s": cpu[name],
+                "cpu_pct": cpu[name] / wall[name] * 100 if wall[name] else 0.0,
+            }
+            for name in self.profiles
+        }
+
+    def summary(self):
+        return " | ".join(
+            f"{name} {r['wall_s']:.0f}s {r['cpu_pct']:.0f}% cpu"
+            for name, r in self.report().items() if r["wall_s"]
+        )
@@ -0,0 +1,21 @@
+import threading
+import tkinter as tk
+
+from PIL import ImageTk
+
+
+class PreviewSurface:
+    # one canvas image item + one PhotoImage for the whole scan, new frames get
+    # pasted into it instead of piling up new items/images every frame
+
+    def __init__(self, canvas, x, y, size):
+        self.canvas = canvas
+        self.photo = ImageTk.PhotoImage("RGBA", size)
+        self.item = canvas.create_image(x, y, anchor=tk.CENTER, image=self.photo)
+        # compositor writes the frame buffer on the render thread, tk reads it here
+        self.lock = threading.Lock()
+
+    def show(self, image):
+        # tk thread only
+        with self.lock:
+            self.photo.paste(image)
@@ -0,0 +1,197 @@
+import binascii
+import struct
+from typing import NamedTuple
+
+# binary framing for the arduino link, replaces the text lines when
+# ARDUINO_PROTOCOL = "framed" in main.py. every message is one frame:
+#
+#   0xA5 | len u16 | type u8 | seq u16 | payload (len bytes) | crc u16
+#
+# all little endian. crc is crc16-ccitt (poly 0x1021, init 0xFFFF) over
+# everything between the sync byte and the crc, so the sketch can use
+# _crc_ccitt_update() from <util/crc16.h>.
+#
+# a frame with a bad crc can't be trusted at all, its length and seq included.
+# the receiver drops just the sync byte and looks for the next one, and a frame
+# that stops arriving halfway (a garbled length asking for bytes that never
+# come) gets the same treatment once the line has been quiet for a moment.
+# then it asks for a resend with a seq it knows is real:
+#   host:    NAKs every command it's still waiting on, the sketch keeps the last
+#            frame it sent for each running command and sends that again
+#   sketch:  NAKs seq 0, the host sends again every command the board hasn't
+#            ACKed yet. a seq the sketch has already run is not run twice, it
+#            just gets its last reply sent again
+#
+# host -> arduino
+#   PING      no payload, answered with DONE straight away
+#   TIMELINE  n u8, then n x (at_ms u32, pump u8, on u8), the whole compiled
+#             recipe from recipes.py, so the board needs no recipe table
+#   CANCEL    stop whatever is pouring, all pumps off
+#   TEXT      utf-8 command for the old sketches ("LED ON" etc)
+#   NAK       one of the board's frames was lost, resend your last one for seq
+# arduino -> host
+#   ACK       frame accepted
+#   PROGRESS  step u8, steps u8, pump u8, on u8, elapsed_ms u32, one per event played
+#   DONE      finished
+#   ERR       utf-8 reason
+#   NAK       one of ours was lost, seq 0 = resend everything not ACKed yet
+#   LOG       utf-8 debug print, not tied to a command (seq 0)
+
+SYNC = 0xA5
+HEADER = struct.Struct("<BHBH")     # sync, len, type, seq
+CRC = struct.Struct("<H")
+EVENT = struct.Struct("<IBB")       # at_ms, pump, on
+PROGRESS = struct.Struct("<BBBBI")  # step, steps, pump, on, elapsed_ms
+MAX_PAYLOAD = 240                   # what the sketch's rx buffer holds
+MAX_EVENTS = (MAX_PAYLOAD - 1) // EVENT.size
+
+PING = 0x01
+TIMELINE = 0x02
+CANCEL = 0x03
+TEXT = 0x04
+
+ACK = 0x81
+PROGRESS_MSG = 0x82
+DONE = 0x83
+ERR = 0x84
+NAK = 0x85
+LOG = 0x86
+
+NAMES = {
+    PING: "PING", TIMELINE: "TIMELINE", CANCEL: "CANCEL", TEXT: "TEXT",
+    ACK: "ACK", PROGRESS_MSG: "PROGRESS", DONE: "DONE", ERR: "ERR", NAK: "NAK", LOG: "LOG",
+}
+
+
+class ProtocolError(ValueError):
+    pass
+
+
+class Frame(NamedTuple):
+    type: int
+    seq: int
+    payload: bytes
+
+
+class Progress(NamedTuple):
+    step: int
+    steps: int
+    pump: int
+    on: bool
+    elapsed: float
+
+    def __str__(self):
+        return f"Dispensing: Pump {self.pump}" if self.on else f"Pump {self.pump} done"
+
+
+def crc16(data):
+    # crc16-ccitt, init 0xFFFF
+    return binascii.crc_hqx(data, 0xFFFF)
+
+
+def encode(msg_type, seq, payload=b""):
+    if len(payload) > MAX_PAYLOAD:
+        raise ProtocolError(f"payload is {len(payload)} bytes, max is {MAX_PAYLOAD}")
+    head = HEADER.pack(SYNC, len(payload), msg_type, seq & 0xFFFF)
+    return head + payload + CRC.pack(crc16(head[1:] + payload))
+
+
+class Decoder:
+    # feed it raw serial bytes, get whole good frames back. resyncs on the next
+    # 0xA5 after garbage or a bad crc, bad_crc / truncated going up tells the
+    # caller something was lost and it should ask for a resend
+
+    def __init__(self):
+        self.buf = bytearray()
+        self.bad_crc = 0
+        self.truncated = 0      # half frames thrown out by flush()
+        self.skipped = 0
+
+    @property
+    def lost(self):
+        return self.bad_crc + self.truncated
+
+    def feed(self, data):
+        self.buf += data
+        out = []
+        while True:
+            start = self.buf.find(SYNC)
+            if start < 0:
+                self.skipped += len(self.buf)
+                self.buf.clear()
+                break
+            if start:
+                self.skipped += start
+                del self.buf[:start]
+            if len(self.buf) < HEADER.size:
+                break
+
+            _, length, msg_type, seq = HEADER.unpack_from(self.buf)
+            if length > MAX_PAYLOAD:
+                # not a real header, drop the sync byte and look again
+                self.skipped += 1
+                del self.buf[:1]
+                continue
+            end = HEADER.size + length + CRC.size
+            if len(self.buf) < end:
+                break
+
+            (crc,) = CRC.unpack_from(self.buf, HEADER.size + length)
+            if crc != crc16(bytes(self.buf[1:HEADER.size + length])):
+                # the length may be the broken part, so don't skip the whole
+                # "frame": the next real one can be sitting inside it
+                self.bad_crc += 1
+                self.skipped += 1
+                del self.buf[:1]
+                continue
+
+            out.append(Frame(msg_type, seq, bytes(self.buf[HEADER.size:HEADER.size + length])))
+            del self.buf[:end]
+        return out
+
+    def flush(self):
+        # the line went quiet with half a frame buffered, it's never getting
+        # finished. drop its sync byte and decode whatever is behind it
+        out = []
+        if self.buf:
+            self.truncated += 1
+        while self.buf:
+            self.skipped += 1
+            del self.buf[:1]
+            out += self.feed(b"")
+        return out
+
+
+def encode_timeline(timeline):
+    # recipes.Timeline -> TIMELINE payload, times go over as whole milliseconds
+    events = timeline.events
+    if len(events) > MAX_EVENTS:
+        raise ProtocolError(f"{timeline.mood}: {len(events)} events, a frame holds {MAX_EVENTS}")
+    parts = [struct.pack("<B", len(events))]
+    for at, pump, on in events:
+        parts.append(EVENT.pack(round(at * 1000), pump, bool(on)))
+    return b"".join(parts)
+
+
+def decode_timeline(payload):
+    # TIMELINE payload -> ((seconds, pump, on), ...), what the sketch does in C
+    if not payload:
+        raise ProtocolError("empty timeline")
+    n = payload[0]
+    if len(payload) != 1 + n * EVENT.size:
+        raise ProtocolError(f"timeline says {n} events but has {len(payload) - 1} bytes")
+    return tuple(
+        (at_ms / 1000, pump, bool(on))
+        for at_ms, pump, on in EVENT.iter_unpack(payload[1:])
+    )
+
+
+def encode_progress(step, steps, pump, on, elapsed):
+    return PROGRESS.pack(step, steps, pump, bool(on), round(elapsed * 1000))
+
+
+def decode_progress(payload):
+    if len(payload) != PROGRESS.size:
+        raise ProtocolError(f"PROGRESS payload is {len(payload)} bytes, expected {PROGRESS.size}")
+    step, steps, pump, on, elapsed_ms = PROGRESS.unpack(payload)
+    return Progress(step, steps, pump, bool(on), elapsed_ms / 1000)
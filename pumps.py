@@ -20,36 +20,113 @@ pumps = {
 }
 
 
-# recipe list
-RECIPES = {
-    "HAPPY": {
-        "name": "rnadom shit",
-        "steps": [(1, 2.0), (3, 1.0), (5, 0.5)]
-    }
-}
-# ^^ 
-# (which pump, seconds)
+# recipes live in recipes.json (in ml) and get compiled by recipes.py
 
 def stop_all_pumps():
     for p in pumps.values():
         p.off()
 
 
+# how many pumps can be on at once (power supply budget)
+MAX_ACTIVE_PUMPS = 3
+
+
 # run a recipe, with status to put on screen
-def run_recipe(steps, status_cb=None):
+# steps on different pumps run at the same time, up to max_active at once
+# after = {step index: [step indexes that must finish first]} for ordering
+# cancel = threading.Event, set it to stop mid recipe
+# returns True if the whole recipe ran, False if it got cancelled
+def run_recipe(steps, status_cb=None, max_active=MAX_ACTIVE_PUMPS, after=None, cancel=None):
+    after = after or {}
+    for pump_num, secs in steps:
+        if pump_num not in pumps:
+            raise ValueError(f"Unknown pump {pump_num}")
+
+    pending = list(range(len(steps)))
+    running = {}     # step index -> monotonic deadline
+    done = set()
+
+    try:
+        stop_all_pumps()
+
+        while pending or running:
+            if cancel is not None and cancel.is_set():
+                if status_cb:
+                    status_cb("cancelled")
+                return False
+
+            now = time.monotonic()
+
+            # turn off anything that's finished
+            for i, deadline in list(running.items()):
+                if deadline <= now:
+                    pumps[steps[i][0]].off()
+                    del running[i]
+                    done.add(i)
+
+            # start whatever is allowed, in recipe order
+            busy = {steps[i][0] for i in running}
+            for i in list(pending):
+                if len(running) >= max_active:
+                    break
+                pump_num, secs = steps[i]
+                if pump_num in busy or not all(d in done for d in after.get(i, ())):
+                    continue
+
+                if status_cb:
+                    status_cb(f"Dispensing: Pump {pump_num} for {secs:.1f}s")
+                pumps[pump_num].on()
+                running[i] = now + secs
+                busy.add(pump_num)
+                pending.remove(i)
+
+            if not running:
+                if pending:
+                    raise ValueError(f"Recipe steps {pending} can never start, check 'after'")
+                break
+
+            # sleep until the next pump is due off (or we get cancelled)
+            wait = max(min(running.values()) - time.monotonic(), 0)
+            if cancel is not None:
+                cancel.wait(wait)
+            else:
+                time.sleep(wait)
+
+        if status_cb:
+            status_cb("drink ready!")
+        return True
+
+    finally:
+        stop_all_pumps()
+
+
+# play back a compiled recipe timeline (see recipes.py), nothing gets worked out here
+# returns True if the whole drink ran, False if it got cancelled
+def run_timeline(timeline, status_cb=None, cancel=None):
+    t0 = time.monotonic()
     try:
         stop_all_pumps()
 
-        for pump_num, secs in steps:
-            if status_cb:
-                status_cb(f"Dispensing: Pump {pump_num} for {secs:.1f}s")
+        for at, pump_num, on in timeline.events:
+            wait = t0 + at - time.monotonic()
+            if cancel is not None:
+                if cancel.wait(max(wait, 0)):
+                    if status_cb:
+                        status_cb("cancelled")
+                    return False
+            elif wait > 0:
+                time.sleep(wait)
 
-            pumps[pump_num].on()
-            time.sleep(secs)
-            pumps[pump_num].off()
+            if on:
+                pumps[pump_num].on()
+                if status_cb:
+                    status_cb(f"Dispensing: Pump {pump_num}")
+            else:
+                pumps[pump_num].off()
 
         if status_cb:
             status_cb("drink ready!")
+        return True
 
     finally:
         stop_all_pumps()
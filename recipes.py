@@ -0,0 +1,274 @@
+import heapq
+import json
+import os
+from functools import lru_cache
+from types import MappingProxyType
+from typing import NamedTuple
+
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+RECIPES_PATH = os.path.join(HERE, "recipes.json")
+CALIBRATION_PATH = os.path.join(HERE, "calibration.json")
+
+# recipes are in millilitres per ingredient, calibration.json says which pump
+# has which ingredient and how fast it flows. both get compiled once into
+# fixed on/off timelines so a dispense just plays them back. blend() mixes the
+# recipes by the whole emotion score vector instead of just the top mood
+#
+# a recipe can order its ingredients with "after", e.g. grenadine only once
+# the orange juice is in so it sinks:
+#   "HAPPY": {"name": ..., "ml": {...}, "after": {"grenadine": ["orange juice"]}}
+# everything else runs at the same time, up to max_active pumps at once
+
+
+class RecipeError(ValueError):
+    pass
+
+
+class PumpCal(NamedTuple):
+    pump: int
+    ingredient: str
+    ml_per_sec: float
+    prime_ml: float     # dead volume in the tube, filled before anything comes out
+    max_ml: float = float("inf")    # most of this ingredient one drink can get
+
+
+class Timeline(NamedTuple):
+    mood: str
+    name: str
+    events: tuple       # ((seconds from start, pump, True=on / False=off), ...) sorted by time
+    volumes: tuple      # ((ingredient, ml), ...)
+    duration: float
+    after: tuple = ()   # ((ingredient, (ingredients it waits for, ...)), ...)
+
+
+def load_calibration(path=CALIBRATION_PATH):
+    with open(path) as f:
+        raw = json.load(f)
+
+    cal = {}
+    seen = set()
+    for pump, c in raw["pumps"].items():
+        pc = PumpCal(
+            int(pump), c["ingredient"], float(c["ml_per_sec"]), float(c.get("prime_ml", 0.0)),
+            float(c.get("max_ml", float("inf"))),
+        )
+        if pc.ml_per_sec <= 0:
+            raise RecipeError(f"Pump {pump}: ml_per_sec must be > 0")
+        if pc.prime_ml < 0:
+            raise RecipeError(f"Pump {pump}: prime_ml can't be negative")
+        if pc.max_ml <= 0:
+            raise RecipeError(f"Pump {pump}: max_ml must be > 0")
+        if pc.ingredient in seen:
+            raise RecipeError(f"Ingredient '{pc.ingredient}' is on more than one pump")
+        seen.add(pc.ingredient)
+        cal[pc.ingredient] = pc
+
+    return MappingProxyType(cal), int(raw.get("max_active", 3)), float(raw.get("cup_ml", 350))
+
+
+def pump_seconds(cal, ml):
+    # time the pump has to run to put ml into the cup, tube priming included
+    return (ml + cal.prime_ml) / cal.ml_per_sec
+
+
+def schedule(steps, max_active, after=None):
+    # steps = [(pump, secs)] on different pumps -> on/off events
+    # after = {step index: [step indexes that have to finish first]}
+    # longest ready step first into each free slot keeps the total time down
+    after = after or {}
+    pending = sorted(range(len(steps)), key=lambda i: -steps[i][1])
+    running = []    # heap of (end, step index)
+    done = set()
+    now = 0.0
+    events = []
+    while pending or running:
+        for i in list(pending):
+            if len(running) >= max_active:
+                break
+            if all(d in done for d in after.get(i, ())):
+                pending.remove(i)
+                pump, secs = steps[i]
+                heapq.heappush(running, (now + secs, i))
+                events.append((now, pump, True))
+                events.append((now + secs, pump, False))
+        if not running:
+            raise RecipeError(f"steps {pending} can never start, 'after' goes round in a circle")
+
+        # jump to the next pump finishing, and anything finishing with it
+        now, i = heapq.heappop(running)
+        done.add(i)
+        while running and running[0][0] <= now:
+            done.add(heapq.heappop(running)[1])
+
+    # offs before ons at the same instant so we never go over max_active
+    events.sort(key=lambda e: (e[0], e[2]))
+    return tuple(events)
+
+
+def compile_recipe(mood, recipe, cal, max_active, cup_ml):
+    volumes = recipe["ml"]
+    if not volumes:
+        raise RecipeError(f"{mood}: no ingredients")
+
+    steps = []
+    for ingredient, ml in volumes.items():
+        if ingredient not in cal:
+            raise RecipeError(f"{mood}: no pump has '{ingredient}'")
+        if ml <= 0:
+            raise RecipeError(f"{mood}: '{ingredient}' needs a positive volume")
+        steps.append((cal[ingredient].pump, pump_seconds(cal[ingredient], ml)))
+
+    total = sum(volumes.values())
+    if total > cup_ml:
+        raise RecipeError(f"{mood}: {total:.0f}ml doesn't fit in a {cup_ml:.0f}ml cup")
+
+    # ingredient names -> step indexes
+    index = {ing: i for i, ing in enumerate(volumes)}
+    after = {}
+    for ingredient, deps in recipe.get("after", {}).items():
+        for name in [ingredient, *deps]:
+            if name not in index:
+                raise RecipeError(f"{mood}: 'after' names '{name}', which isn't in the recipe")
+        after[index[ingredient]] = [index[d] for d in deps]
+
+    try:
+        events = schedule(steps, max_active, after)
+    except RecipeError as e:
+        raise RecipeError(f"{mood}: {e}") from None
+    return Timeline(
+        mood=mood,
+        name=recipe.get("name", f"{mood.title()} Mix"),
+        events=events,
+        volumes=tuple(volumes.items()),
+        duration=events[-1][0],
+        after=tuple((ing, tuple(deps)) for ing, deps in recipe.get("after", {}).items()),
+    )
+
+
+@lru_cache(maxsize=None)
+def load_timelines(recipes_path=RECIPES_PATH, calibration_path=CALIBRATION_PATH):
+    # compiled + validated once, every dispense after that reuses the same objects
+    cal, max_active, cup_ml = load_calibration(calibration_path)
+    with open(recipes_path) as f:
+        recipes = json.load(f)
+
+    return MappingProxyType({
+        mood.upper(): compile_recipe(mood.upper(), r, cal, max_active, cup_ml)
+        for mood, r in recipes.items()
+    })
+
+
+def get_timeline(mood):
+    timelines = load_timelines()
+    return timelines.get(mood.upper(), timelines.get("NEUTRAL"))
+
+
+class Blender(NamedTuple):
+    moods: tuple            # row order of matrix, same as emotion.EMOTIONS
+    names: tuple            # drink name per mood
+    ingredients: tuple      # column order of matrix
+    matrix: np.ndarray      # (moods, ingredients), each row = that recipe as fractions of its volume
+    caps: np.ndarray        # (ingredients,) max ml per drink
+    drink_ml: float
+    min_ml: float
+    cal: MappingProxyType
+    max_active: int
+    cup_ml: float
+    after: MappingProxyType     # ingredient -> ingredients it waits for, from every recipe
+
+
+@lru_cache(maxsize=None)
+def load_blender(recipes_path=RECIPES_PATH, calibration_path=CALIBRATION_PATH):
+    # the recipes as one matrix, built once. a drink is then scores @ matrix
+    from emotion import EMOTIONS
+
+    timelines = load_timelines(recipes_path, calibration_path)   # validates everything
+    cal, max_active, cup_ml = load_calibration(calibration_path)
+    with open(calibration_path) as f:
+        raw = json.load(f)
+    drink_ml = float(raw.get("drink_ml", cup_ml))
+    min_ml = float(raw.get("min_ml", 0.0))
+    if not 0 < drink_ml <= cup_ml:
+        raise RecipeError(f"drink_ml has to be between 0 and cup_ml ({cup_ml:.0f})")
+
+    moods = tuple(e.upper() for e in EMOTIONS)
+    missing = [m for m in moods if m not in timelines]
+    if missing:
+        raise RecipeError(f"Blending needs a recipe for every mood, missing {', '.join(missing)}")
+
+    ingredients = tuple(cal)
+    col = {ing: i for i, ing in enumerate(ingredients)}
+    matrix = np.zeros((len(moods), len(ingredients)))
+    for r, mood in enumerate(moods):
+        volumes = timelines[mood].volumes
+        total = sum(ml for _, ml in volumes)
+        for ing, ml in volumes:
+            matrix[r, col[ing]] = ml / total
+    matrix.setflags(write=False)
+
+    caps = np.array([cal[ing].max_ml for ing in ingredients])
+    caps.setflags(write=False)
+
+    # a blend keeps every ordering any recipe asked for, so they can't contradict
+    after = {}
+    for t in timelines.values():
+        for ing, deps in t.after:
+            after.setdefault(ing, set()).update(deps)
+    after = {ing: sorted(deps) for ing, deps in after.items()}
+    steps = [(cal[ing].pump, 1.0) for ing in ingredients]
+    try:
+        schedule(steps, max_active, {col[ing]: [col[d] for d in deps] for ing, deps in after.items()})
+    except RecipeError:
+        raise RecipeError("The recipes' 'after' orderings contradict each other, can't blend them") from None
+
+    return Blender(
+        moods, tuple(timelines[m].name for m in moods), ingredients, matrix, caps,
+        drink_ml, min_ml, cal, max_active, cup_ml, MappingProxyType(after),
+    )
+
+
+def blend_volumes(scores, blender=None):
+    # (7,) emotion scores in any scale -> (ingredients,) ml, same maths for every input
+    b = blender or load_blender()
+    w = np.clip(np.asarray(scores, dtype=np.float64), 0, None)
+    total = w.sum()
+    w = w / total if total > 0 else np.eye(len(b.moods))[b.moods.index("NEUTRAL")]
+
+    ml = np.minimum(w @ b.matrix * b.drink_ml, b.caps)
+    # splashes too small for the pump to meter get dropped
+    ml = np.where(ml >= b.min_ml, ml, 0.0)
+    # never more than the cup holds, caps only ever take volume away
+    return ml * min(1.0, b.cup_ml / max(ml.sum(), 1e-9))
+
+
+def blend(emotions, blender=None):
+    # emotions dict (emotion.EMOTIONS keys, percent) -> Timeline for that exact mix
+    # named after the strongest mood's drink
+    b = blender or load_blender()
+    scores = np.array([emotions.get(m.lower(), 0.0) for m in b.moods])
+    ml = blend_volumes(scores, b)
+
+    top = b.moods[int(scores.argmax())] if scores.any() else "NEUTRAL"
+    volumes = {ing: round(float(v), 1) for ing, v in zip(b.ingredients, ml) if v > 0}
+    after = {
+        ing: [d for d in deps if d in volumes]
+        for ing, deps in b.after.items() if ing in volumes
+    }
+    recipe = {"name": b.names[b.moods.index(top)], "ml": volumes, "after": after}
+    return compile_recipe(top, recipe, b.cal, b.max_active, b.cup_ml)
+
+
+if __name__ == "__main__":
+    # print what every recipe compiles to, handy after changing calibration.json
+    for t in load_timelines().values():
+        print(f"{t.mood:<10} {t.name:<16} {t.duration:5.2f}s  " +
+              ", ".join(f"{ing} {ml}ml" for ing, ml in t.volumes))
+
+    # and a couple of blends
+    for emotions in ({"happy": 60, "surprise": 40}, {"sad": 45, "neutral": 35, "fear": 20}):
+        t = blend(emotions)
+        mix = " ".join(f"{e} {v}%" for e, v in emotions.items())
+        print(f"\n{mix}\n  -> {t.name}, {t.duration:.2f}s  " +
+              ", ".join(f"{ing} {ml}ml" for ing, ml in t.volumes))
@@ -0,0 +1,156 @@
+import argparse
+import csv
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from emotion import EMOTIONS
+from config import DETECTOR, HOLD_FRAMES, HOLD_GATE, HOLD_SECS, MIN_NEIGHBORS, SCALE_FACTOR
+
+# runs recorded sessions through the kiosk's detection + emotion code with no
+# tk and no camera, as fast as the cpu goes. one input (video file or image
+# folder) = one session, every hold-still capture in it = one mood result
+#   python replay.py sessions/*.mp4 --workers 4 --min-neighbors 4 --gate 0.3
+
+FRAME_FIELDS = ["session", "frame", "t", "faces", "x", "y", "w", "h", "state", "detect_ms"]
+MOOD_FIELDS = ["session", "scan", "t_start", "t_capture", "frames", "dominant", "infer_ms"] + EMOTIONS
+
+# one emotion model per worker process
+_service = None
+
+
+def _emotion():
+    global _service
+    if _service is None:
+        from emotion import EmotionService
+        _service = EmotionService()
+        _service.start()
+        if not _service.wait():
+            raise RuntimeError(_service.error)
+    return _service
+
+
+def replay_session(path, opts):
+    from camera import FileSource
+    from detector import FaceTracker, HoldStill, make_detector
+
+    source = FileSource(path, opts["width"], opts["height"], loop=False)
+    source.open()
+    fps = source.fps or opts["fps"]
+
+    backend = make_detector(opts["detector"], opts["scale_factor"], opts["min_neighbors"])
+    tracker = FaceTracker(backend, scale=opts["detect_scale"])
+    hold = HoldStill(opts["hold_secs"], opts["gate"], max_faces=opts["hold_frames"])
+    session = os.path.basename(path.rstrip("/"))
+
+    frames, moods = [], []
+    n = 0
+    while True:
+        try:
+            frame = source.capture()
+        except EOFError:
+            break
+        # video time, not wall time, so the gate behaves like it would live
+        t = n / fps
+
+        t0 = time.perf_counter()
+        faces = tracker.detect(frame)
+        detect_ms = (time.perf_counter() - t0) * 1000
+
+        state = hold.update(frame, tracker.last_box if faces else None, t)
+        box = tracker.last_box or (None, None, None, None)
+        frames.append([session, n, round(t, 3), len(faces), *box, state, round(detect_ms, 2)])
+
+        if state == "captured":
+            row = [session, len(moods), round(hold.start, 3), round(t, 3), len(hold.faces)]
+            if opts["emotion"]:
+                t0 = time.perf_counter()
+                emotions = _emotion().analyze_batch(list(hold.faces))
+                infer_ms = (time.perf_counter() - t0) * 1000
+                dominant = max(emotions, key=emotions.get)
+                row += [dominant.upper(), round(infer_ms, 1)] + [round(emotions[e], 3) for e in EMOTIONS]
+            else:
+                row += [""] * (2 + len(EMOTIONS))
+            moods.append(row)
+
+            # start over like the kiosk does for the next customer
+            hold.reset()
+            tracker.reset()
+        n += 1
+
+    source.close()
+    return session, frames, moods
+
+
+def write_table(path, fields, rows):
+    if path.endswith(".parquet"):
+        import pandas as pd
+        pd.DataFrame(rows, columns=fields).to_parquet(path, index=False)
+        return
+    with open(path, "w", newline="") as f:
+        w = csv.writer(f)
+        w.writerow(fields)
+        w.writerows(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay recorded sessions through detection + emotion, headless")
+    parser.add_argument("inputs", nargs="+", help="video files and/or image folders")
+    parser.add_argument("--workers", type=int, default=1, help="processes to spread sessions over")
+    parser.add_argument("--detector", default=DETECTOR, help="haar / lbp / yunet")
+    parser.add_argument("--scale-factor", type=float, default=SCALE_FACTOR)
+    parser.add_argument("--min-neighbors", type=int, default=MIN_NEIGHBORS)
+    parser.add_argument("--detect-scale", type=float, default=0.5, help="downscale before the cascade")
+    parser.add_argument("--hold-secs", type=float, default=HOLD_SECS)
+    parser.add_argument("--gate", type=float, default=HOLD_GATE)
+    parser.add_argument("--hold-frames", type=int, default=HOLD_FRAMES)
+    parser.add_argument("--fps", type=float, default=30, help="frame rate for image folders")
+    parser.add_argument("--width", type=int, default=640)
+    parser.add_argument("--height", type=int, default=380)
+    parser.add_argument("--no-emotion", action="store_true", help="detection only")
+    parser.add_argument("--frames-out", default="replay_frames.csv", help=".csv or .parquet")
+    parser.add_argument("--moods-out", default="replay_moods.csv", help=".csv or .parquet")
+    args = parser.parse_args()
+
+    opts = {
+        "detector": args.detector,
+        "scale_factor": args.scale_factor,
+        "min_neighbors": args.min_neighbors,
+        "detect_scale": args.detect_scale,
+        "hold_secs": args.hold_secs,
+        "gate": args.gate,
+        "hold_frames": args.hold_frames,
+        "fps": args.fps,
+        "width": args.width,
+        "height": args.height,
+        "emotion": not args.no_emotion,
+    }
+
+    t0 = time.perf_counter()
+    all_frames, all_moods = [], []
+
+    if args.workers > 1:
+        with ProcessPoolExecutor(args.workers) as pool:
+            results = pool.map(replay_session, args.inputs, [opts] * len(args.inputs))
+            for session, frames, moods in results:
+                print(f"  {session}: {len(frames)} frames, {len(moods)} scans")
+                all_frames += frames
+                all_moods += moods
+    else:
+        for path in args.inputs:
+            session, frames, moods = replay_session(path, opts)
+            print(f"  {session}: {len(frames)} frames, {len(moods)} scans")
+            all_frames += frames
+            all_moods += moods
+
+    elapsed = time.perf_counter() - t0
+    print(f"\n{len(all_frames)} frames in {elapsed:.1f}s ({len(all_frames) / max(elapsed, 1e-9):.0f} fps), "
+          f"{len(all_moods)} scans")
+
+    write_table(args.frames_out, FRAME_FIELDS, all_frames)
+    write_table(args.moods_out, MOOD_FIELDS, all_moods)
+    print(f"wrote {args.frames_out} and {args.moods_out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,239 @@
+import argparse
+import csv
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+from emotion import EMOTIONS
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SESSION_DB = os.path.join(HERE, "sessions.db")
+
+# one row per customer: what the model saw, what they picked, how long each
+# stage took and whether the drink came out. rows go through a queue to one
+# writer thread that commits them in batches, so the scan/ui threads never
+# touch the disk. sqlite in wal mode, append only
+#   python sessionlog.py report --hours 24
+#   python sessionlog.py export sessions.csv
+
+# emotions are stored as integer tenths of a percent and timings as integer
+# milliseconds, sqlite packs small ints into 1-2 bytes so rows stay small
+TIMINGS = ["scan", "infer", "decide", "queue", "dispense", "total"]
+COLUMNS = (
+    ["ts", "outcome", "dominant", "chosen", "drink", "frames"]
+    + EMOTIONS
+    + [f"{t}_ms" for t in TIMINGS]
+    + ["error"]
+)
+
+SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS sessions (
+    id INTEGER PRIMARY KEY,
+    ts REAL NOT NULL,
+    outcome TEXT NOT NULL,
+    dominant TEXT,
+    chosen TEXT,
+    drink TEXT,
+    frames INTEGER,
+    {", ".join(f"{e} INTEGER" for e in EMOTIONS)},
+    {", ".join(f"{t}_ms INTEGER" for t in TIMINGS)},
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS sessions_ts ON sessions (ts);
+"""
+
+
+class Session:
+    # filled in as the customer goes through the screens, logged once at the end
+    # outcome: done / failed / scan_again / cancelled
+
+    def __init__(self):
+        self.started = time.time()
+        self.shown = None       # when the mood screen came up
+        self.emotions = None
+        self.dominant = None
+        self.chosen = None
+        self.drink = None
+        self.frames = None
+        self.timings = {}       # stage -> seconds, keys from TIMINGS
+        self.outcome = None
+        self.error = None
+
+    def row(self):
+        self.timings.setdefault("total", time.time() - self.started)
+        emotions = self.emotions or {}
+        return (
+            [self.started, self.outcome, self.dominant, self.chosen, self.drink, self.frames]
+            + [_tenths(emotions.get(e)) for e in EMOTIONS]
+            + [_ms(self.timings.get(t)) for t in TIMINGS]
+            + [self.error]
+        )
+
+
+def _tenths(pct):
+    return None if pct is None else round(pct * 10)
+
+
+def _ms(secs):
+    return None if secs is None else round(secs * 1000)
+
+
+def connect(path=SESSION_DB):
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode=WAL")
+    # wal + normal only fsyncs at checkpoints, plenty for a log
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript(SCHEMA)
+    return conn
+
+
+class SessionLog:
+    def __init__(self, path=SESSION_DB, batch=32, flush_every=2.0):
+        self.path = path
+        self.batch = batch
+        self.flush_every = flush_every    # max seconds a row sits in memory
+        self.written = 0
+        self._queue = queue.Queue()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._writer, name="session-log", daemon=True)
+        self._thread.start()
+        return self
+
+    def log(self, session, outcome=None, error=None):
+        # never blocks, the row gets built here so later edits to session don't leak in
+        if outcome:
+            session.outcome = outcome
+        if error:
+            session.error = str(error)
+        self._queue.put(session.row())
+
+    def close(self, timeout=5.0):
+        # flush whatever is queued and stop the writer
+        if self._thread:
+            self._queue.put(None)
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _writer(self):
+        conn = connect(self.path)
+        insert = f"INSERT INTO sessions ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})"
+        stop = False
+        while not stop:
+            rows = []
+            try:
+                row = self._queue.get(timeout=self.flush_every)
+            except queue.Empty:
+                continue
+
+            # grab whatever else piled up, one transaction for the lot
+            deadline = time.monotonic() + 0.05
+            while row is not None:
+                rows.append(row)
+                if len(rows) >= self.batch:
+                    break
+                try:
+                    row = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+            stop = row is None
+
+            if rows:
+                try:
+                    with conn:
+                        conn.executemany(insert, rows)
+                    self.written += len(rows)
+                except sqlite3.Error as e:
+                    print(f"Session log write failed ({len(rows)} rows lost): {e}")
+        conn.close()
+
+
+def _percentile(values, q):
+    values = sorted(values)
+    return values[min(int(q * len(values)), len(values) - 1)]
+
+
+def report(path=SESSION_DB, hours=None):
+    conn = connect(path)
+    where, args = "", []
+    if hours:
+        where, args = "WHERE ts >= ?", [time.time() - hours * 3600]
+
+    print("\n  throughput per hour")
+    print(f"  {'hour':<17} {'scans':>6} {'poured':>7} {'failed':>7} {'walked':>7}")
+    print("  " + "-" * 48)
+    rows = conn.execute(f"""
+        SELECT strftime('%Y-%m-%d %H:00', ts, 'unixepoch', 'localtime') AS hour,
+               COUNT(*),
+               SUM(outcome = 'done'),
+               SUM(outcome = 'failed'),
+               SUM(outcome IN ('scan_again', 'cancelled'))
+        FROM sessions {where} GROUP BY hour ORDER BY hour
+    """, args).fetchall()
+    for hour, n, done, failed, walked in rows:
+        print(f"  {hour:<17} {n:>6} {done:>7} {failed:>7} {walked:>7}")
+    if not rows:
+        print("  no sessions")
+
+    print("\n  latency (ms)")
+    print(f"  {'stage':<10} {'n':>6} {'p50':>8} {'p90':>8} {'p99':>8} {'max':>8}")
+    print("  " + "-" * 52)
+    for t in TIMINGS:
+        sep = "AND" if where else "WHERE"
+        values = [v for (v,) in conn.execute(
+            f"SELECT {t}_ms FROM sessions {where} {sep} {t}_ms IS NOT NULL", args)]
+        if values:
+            print(f"  {t:<10} {len(values):>6} {_percentile(values, 0.5):>8} "
+                  f"{_percentile(values, 0.9):>8} {_percentile(values, 0.99):>8} {max(values):>8}")
+
+    print("\n  moods")
+    for mood, n in conn.execute(
+            f"SELECT dominant, COUNT(*) FROM sessions {where} GROUP BY dominant ORDER BY 2 DESC", args):
+        if mood:
+            print(f"  {mood:<10} {n:>6}")
+    conn.close()
+
+
+def export(out, path=SESSION_DB, hours=None):
+    # back to readable units: percent and seconds
+    conn = connect(path)
+    where, args = ("WHERE ts >= ?", [time.time() - hours * 3600]) if hours else ("", [])
+    n = 0
+    with open(out, "w", newline="") as f:
+        w = csv.writer(f)
+        w.writerow(["time"] + COLUMNS[1:6] + EMOTIONS + [f"{t}_s" for t in TIMINGS] + ["error"])
+        for row in conn.execute(f"SELECT {', '.join(COLUMNS)} FROM sessions {where} ORDER BY ts", args):
+            row = list(row)
+            stamp = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(row[0]))
+            emo = [None if v is None else v / 10 for v in row[6:6 + len(EMOTIONS)]]
+            secs = [None if v is None else v / 1000 for v in row[6 + len(EMOTIONS):-1]]
+            w.writerow([stamp] + row[1:6] + emo + secs + [row[-1]])
+            n += 1
+    conn.close()
+    print(f"wrote {n} sessions to {out}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Query the kiosk session log")
+    parser.add_argument("--db", default=SESSION_DB)
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("report", help="throughput per hour + stage latencies")
+    p.add_argument("--hours", type=float, help="only the last n hours")
+    p = sub.add_parser("export", help="dump sessions to csv")
+    p.add_argument("out")
+    p.add_argument("--hours", type=float)
+    args = parser.parse_args()
+
+    if not os.path.exists(args.db):
+        raise SystemExit(f"No session log at {args.db}")
+    if args.cmd == "report":
+        report(args.db, args.hours)
+    else:
+        export(args.out, args.db, args.hours)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+import threading
+import time
+
+# keep this module light, it gets imported before anything heavy so the
+# clock starts as early as possible
+_T0 = time.perf_counter()
+
+
+class StartupTimer:
+    # named marks relative to process start, plus how long each subsystem took
+
+    def __init__(self):
+        self.t0 = _T0
+        self.marks = []
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def mark(self, name):
+        with self._lock:
+            self.marks.append((name, time.perf_counter() - self.t0))
+
+    def span(self, name, started, ended, state):
+        with self._lock:
+            self.spans.append((name, started - self.t0, ended - self.t0, state))
+
+    def report(self):
+        lines = ["", "  STARTUP TIMING", "  " + "-" * 56]
+        for name, at in self.marks:
+            lines.append(f"  {name:<28} at {at * 1000:8.0f} ms")
+        for name, start, end, state in sorted(self.spans, key=lambda s: s[1]):
+            lines.append(
+                f"  {name:<28} {start * 1000:6.0f} -> {end * 1000:6.0f} ms"
+                f"  ({(end - start) * 1000:.0f} ms, {state})"
+            )
+        lines.append("  " + "-" * 56)
+        return "\n".join(lines)
+
+
+class Subsystem:
+    # something slow (imports, hardware) that gets brought up off the tk thread
+    # states: idle -> loading -> ready (or failed)
+
+    def __init__(self, name, init_fn, timer=None):
+        self.name = name
+        self.init_fn = init_fn
+        self.timer = timer
+        self.state = "idle"
+        self.error = None
+        self.duration = None
+        self._done = threading.Event()
+
+    @property
+    def ready(self):
+        return self.state == "ready"
+
+    @property
+    def finished(self):
+        return self.state in ("ready", "failed")
+
+    def start(self):
+        if self.state != "idle":
+            return
+        self.state = "loading"
+        threading.Thread(target=self._run, name=f"init-{self.name}", daemon=True).start()
+
+    def _run(self):
+        t0 = time.perf_counter()
+        try:
+            # init_fn returns False if it came up but isn't usable (e.g. no arduino plugged in)
+            ok = self.init_fn()
+            self.state = "failed" if ok is False else "ready"
+        except Exception as e:
+            self.error = str(e)
+            self.state = "failed"
+            print(f"{self.name} failed to start: {e}")
+        finally:
+            t1 = time.perf_counter()
+            self.duration = t1 - t0
+            if self.timer:
+                self.timer.span(self.name, t0, t1, self.state)
+            self._done.set()
+
+    def wait(self, timeout=None):
+        self._done.wait(timeout)
+        return self.ready